@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import (  # noqa: F401
+            authentication, conditional, counters, feed, images,
+            ingredient_index, popularity, profiling, recipe_cache,
+            shopping_carts, short_links, tokens)
+        authentication.check_denylist_cache()
@@ -0,0 +1,97 @@
+"""Асинхронные обработчики самых частых запросов на чтение.
+
+Подключаются при запуске через ASGI (SERVER_MODE=asgi). Анонимные GET,
+ответ на которые готов без базы данных, — страницы рецептов из кэша и
+продукты из индекса в памяти — отдаются без представлений DRF. Остальные
+запросы передаются обычным представлениям DRF в поток, как Django
+поступает с любым синхронным представлением. В Django 3.2 нет
+асинхронного ORM и асинхронного API кэша, поэтому обращения к кэшу
+выполняются в пуле потоков, а не в цикле событий, но без очереди к
+единственному потоку синхронных представлений.
+"""
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from .conditional import conditional_response
+from .ingredient_index import ingredient_index
+from .recipe_cache import recipe_cache
+from .views import (
+    IngredientViewSet, RecipeViewSet, get_indexed_ingredients,
+    get_ingredients_etag)
+
+
+def is_plain_read(request):
+    """Анонимный GET, которому подходит ответ в JSON."""
+    return (
+        request.method == 'GET'
+        and 'HTTP_AUTHORIZATION' not in request.META
+        and 'format' not in request.GET
+        and 'text/html' not in request.META.get('HTTP_ACCEPT', '')
+    )
+
+
+def with_fast_path(fast_path, view):
+    """Представление, которое сначала пробует ответить через fast_path."""
+    sync_view = sync_to_async(view)
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if is_plain_read(request):
+            response = await fast_path(request, *args, **kwargs)
+            if response is not None:
+                return response
+        return await sync_view(request, *args, **kwargs)
+
+    return async_view
+
+
+def render_json(data):
+    return HttpResponse(
+        JSONRenderer().render(data), content_type='application/json')
+
+
+def in_thread(function):
+    """Корутина, которая выполняет function в пуле потоков."""
+    return sync_to_async(function, thread_sensitive=False)
+
+
+def lookup_recipes(request, pk):
+    return recipe_cache.lookup(recipe_cache.get_key(request, pk))
+
+
+async def get_cached_recipes(request, pk=None):
+    entry = await in_thread(lookup_recipes)(request, pk)
+    if entry is None:
+        return None
+    return recipe_cache.build_response(request, entry, render_json)
+
+
+async def get_ingredients(request):
+    if request.GET.get('search'):
+        return None
+    snapshot = await in_thread(ingredient_index.get_built_snapshot)()
+    if snapshot is None:
+        snapshot = await sync_to_async(ingredient_index.get_snapshot)()
+    return conditional_response(
+        request,
+        partial(get_indexed_ingredients, request, snapshot),
+        get_ingredients_etag(request, snapshot),
+    )
+
+
+recipe_list = with_fast_path(
+    get_cached_recipes,
+    RecipeViewSet.as_view({'get': 'list', 'post': 'create'}),
+)
+recipe_detail = with_fast_path(
+    get_cached_recipes,
+    RecipeViewSet.as_view({
+        'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+        'delete': 'destroy',
+    }),
+)
+ingredient_list = with_fast_path(
+    get_ingredients, IngredientViewSet.as_view({'get': 'list'}))
@@ -0,0 +1,244 @@
+"""Проверка токена авторизации с кэшем токенов.
+
+Найденный токен вместе с пользователем хранится в ограниченном LRU-кэше
+процесса на TOKEN_CACHE_TIMEOUT секунд и, если задан TOKEN_CACHE_ALIAS,
+в общем кэше Django на TOKEN_SHARED_CACHE_TIMEOUT секунд. Записи
+хранятся сериализованными, так что каждый запрос получает свою копию
+пользователя; так же кэшируются пользователи для входа по JWT. При
+выходе (удалении токена) и при сохранении пользователя, в том числе при
+его деактивации, записи удаляются из кэша этого процесса и из общего
+кэша; в остальных процессах запись живёт до истечения
+TOKEN_CACHE_TIMEOUT. Сохранение только last_login и счётчиков кэш не
+сбрасывает. Поэтому пользователь из кэша годится только для чтения: для
+запросов, которые что-то меняют, он заново читается из базы, чтобы
+сохранение устаревшей копии не затёрло, например, деактивацию.
+
+При входе по JWT (AUTH_MODE=jwt) подпись access-токена проверяется
+локально, а отзыв — по компактному списку в кэше JWT_DENYLIST_CACHE. В
+списке хранятся id отозванных токенов, пока они не истекут, и для
+пользователя — время, раньше которого выданные ему токены
+недействительны (деактивация, смена пароля). Этот кэш должен быть общим
+для всех воркеров, иначе отзыв действует только в одном процессе,
+поэтому с кэшем в памяти процесса сервер не запускается. По умолчанию
+список хранится в memcached, и вход по JWT обходится без базы; с кэшем
+в базе каждая проверка стоит запроса по ключу. Адреса для выдачи
+токенов — в api.tokens.
+"""
+import pickle
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import monotonic, time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import authentication, exceptions
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt import authentication as jwt_authentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .metrics import TOKEN_LOOKUP, count_cache
+from recipes.models import FoodgramUser
+
+
+class AuthCache:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+    def get_cache_key(self, key):
+        return f'{self.prefix}:{sha256(key.encode()).hexdigest()}'
+
+    @property
+    def shared(self):
+        alias = settings.TOKEN_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def get(self, key):
+        cache_key = self.get_cache_key(key)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry[0] > monotonic():
+                self.entries.move_to_end(cache_key)
+                return entry[1]
+        data = self.shared and self.shared.get(cache_key)
+        if data is not None:
+            self.remember(cache_key, data)
+        return data
+
+    def set(self, key, data):
+        cache_key = self.get_cache_key(key)
+        self.remember(cache_key, data)
+        if self.shared:
+            self.shared.set(
+                cache_key, data, settings.TOKEN_SHARED_CACHE_TIMEOUT)
+
+    def remember(self, cache_key, data):
+        if settings.TOKEN_CACHE_SIZE <= 0:
+            return
+        with self.lock:
+            self.entries[cache_key] = (
+                monotonic() + settings.TOKEN_CACHE_TIMEOUT, data)
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > settings.TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def delete(self, keys):
+        cache_keys = [self.get_cache_key(key) for key in keys]
+        with self.lock:
+            for cache_key in cache_keys:
+                self.entries.pop(cache_key, None)
+        if self.shared and cache_keys:
+            self.shared.delete_many(cache_keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = AuthCache('auth_token')
+# Пользователи по id для входа по JWT, см. api.tokens.
+user_cache = AuthCache('auth_user')
+# Поля, сохранение которых не сбрасывает кэш: от них не зависит вход,
+# а счётчики меняются UPDATE и в кэше всё равно не обновляются.
+IGNORED_FIELDS = {'last_login', *FoodgramUser.counter_fields}
+
+
+def get_active_user(pk):
+    user = FoodgramUser.objects.filter(pk=pk).first()
+    if user is None or not user.is_active:
+        raise exceptions.AuthenticationFailed(
+            'Пользователь неактивен или удалён.')
+    return user
+
+
+class FreshUserMixin:
+    """Для изменяющих запросов подменяет пользователя копией из базы."""
+
+    def authenticate(self, request):
+        credentials = super().authenticate(request)
+        if credentials is None or request.method in SAFE_METHODS:
+            return credentials
+        user, auth = credentials
+        return get_active_user(user.pk), auth
+
+
+class TokenAuthentication(
+        FreshUserMixin, authentication.TokenAuthentication):
+    """Проверка токена, которая обходится без базы при попадании в кэш."""
+
+    def authenticate_credentials(self, key):
+        with TOKEN_LOOKUP.time():
+            data = token_cache.get(key)
+            count_cache('tokens', data is not None)
+            if data is None:
+                user, token = super().authenticate_credentials(key)
+                token_cache.set(key, pickle.dumps(token))
+                return user, token
+            token = pickle.loads(data)
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(
+                    'Пользователь неактивен или удалён.')
+            return token.user, token
+
+
+DENIED_KEY = 'jwt_denied:{}'
+REVOKED_KEY = 'jwt_revoked:{}'
+PROCESS_CACHE_BACKENDS = {
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+}
+
+
+def get_cache():
+    return caches[settings.JWT_DENYLIST_CACHE]
+
+
+def check_denylist_cache():
+    if settings.AUTH_MODE != 'jwt':
+        return
+    alias = settings.JWT_DENYLIST_CACHE
+    if alias not in settings.CACHES:
+        raise ImproperlyConfigured(
+            f'JWT_DENYLIST_CACHE: кэша {alias} нет в CACHES')
+    if settings.CACHES[alias]['BACKEND'] in PROCESS_CACHE_BACKENDS:
+        raise ImproperlyConfigured(
+            f'JWT_DENYLIST_CACHE: кэш {alias} хранится в памяти процесса, '
+            'и отозванные JWT будут действовать в остальных воркерах. '
+            'Укажите общий кэш, например кэш в базе или memcached')
+
+
+def deny(token):
+    """Отзывает токен до его истечения; False, если он уже отозван."""
+    return get_cache().add(
+        DENIED_KEY.format(token[api_settings.JTI_CLAIM]),
+        True,
+        max(token['exp'] - int(time()), 1),
+    )
+
+
+def revoke_user(user_id):
+    get_cache().set(
+        REVOKED_KEY.format(user_id),
+        time(),
+        int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()),
+    )
+
+
+def check_token(token):
+    denied_key = DENIED_KEY.format(token.get(api_settings.JTI_CLAIM))
+    revoked_key = REVOKED_KEY.format(token.get(api_settings.USER_ID_CLAIM))
+    values = get_cache().get_many((denied_key, revoked_key))
+    if (
+        denied_key in values
+        or token.get('iat', 0) < values.get(revoked_key, 0)
+    ):
+        raise TokenError('Токен отозван')
+
+
+class JWTAuthentication(
+        FreshUserMixin, jwt_authentication.JWTAuthentication):
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        try:
+            check_token(token)
+        except TokenError as error:
+            raise InvalidToken(error.args[0])
+        return token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = str(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken('В токене нет id пользователя')
+        data = user_cache.get(user_id)
+        count_cache('jwt_users', data is not None)
+        if data is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, pickle.dumps(user))
+            return user
+        user = pickle.loads(data)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                'Пользователь неактивен или удалён.')
+        return user
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(instance, **kwargs):
+    token_cache.delete((instance.key,))
+
+
+@receiver(post_save, sender=FoodgramUser)
+def forget_user_tokens(instance, created, update_fields, **kwargs):
+    if created or (update_fields and set(update_fields) <= IGNORED_FIELDS):
+        return
+    user_cache.delete((str(instance.pk),))
+    token_cache.delete(
+        Token.objects.filter(user=instance).values_list('key', flat=True))
@@ -0,0 +1,33 @@
+"""Общее для команд замеров: названия рецептов и статистика времени."""
+from statistics import median, quantiles
+from time import perf_counter
+
+DISHES = (
+    'борщ', 'салат', 'пирог', 'сырники', 'блины', 'суп', 'омлет', 'плов',
+    'рагу', 'каша', 'запеканка', 'котлеты', 'пельмени', 'шарлотка',
+)
+ADJECTIVES = (
+    'домашний', 'быстрый', 'летний', 'острый', 'сырный', 'овощной',
+    'мясной', 'грибной', 'постный', 'праздничный', 'бабушкин',
+)
+
+
+def make_recipe_name(random, number):
+    return f'{random.choice(ADJECTIVES)} {random.choice(DISHES)} №{number}'
+
+
+def measure_ms(function, *args, **kwargs):
+    """(время выполнения в мс, результат function)."""
+    started = perf_counter()
+    result = function(*args, **kwargs)
+    return (perf_counter() - started) * 1000, result
+
+
+def get_percentiles(timings):
+    """p50, p95 и p99 в тех же единицах, что timings."""
+    percentiles = quantiles(timings, n=100)
+    return {
+        'p50': median(timings),
+        'p95': percentiles[94],
+        'p99': percentiles[98],
+    }
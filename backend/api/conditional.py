@@ -0,0 +1,155 @@
+"""Условные GET-запросы: ETag, Last-Modified и ответ 304.
+
+Валидаторы считаются по дешёвым признакам — updated_at рецептов и
+счётчику version пользователей — до сериализации.
+Счётчик пользователя растёт при изменении его профиля, а также его
+избранного, корзины и подписок, от которых зависят флаги is_favorited,
+is_in_shopping_cart и is_subscribed в ответах для него. Рецепт выводится
+с профилем автора, поэтому в его ETag входит и счётчик автора, а в
+Last-Modified — время изменения профиля автора. Счётчик текущего
+пользователя читается из базы: пользователь мог прийти из кэша
+авторизации, а счётчик меняется UPDATE, минуя этот кэш.
+"""
+from functools import partial
+from hashlib import md5
+from urllib.parse import urlencode
+
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .profiling import section
+from recipes.models import (
+    FavoriteRecipe, FoodgramUser, ShoppingCart, Subscription)
+
+PROFILE_FIELDS = {'username', 'first_name', 'last_name', 'email', 'avatar'}
+
+
+def make_etag(*parts):
+    return '"{}"'.format(
+        md5(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def normalize_params(request):
+    return urlencode(sorted(
+        (name, value)
+        for name, values in request.GET.lists()
+        for value in values
+        if value != ''
+    ))
+
+
+def get_viewer(request):
+    user = request.user
+    if not user.is_authenticated:
+        return None, None
+    return user.pk, FoodgramUser.objects.filter(
+        pk=user.pk).values_list('version', flat=True).first()
+
+
+def get_not_modified(request, etag, last_modified=None):
+    """Ответ 304 (или 412), если у клиента актуальная версия."""
+    return get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=last_modified and int(last_modified.timestamp()),
+    )
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def conditional_response(request, get_response, etag, last_modified=None):
+    not_modified = get_not_modified(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    return set_validators(get_response(), etag, last_modified)
+
+
+class ConditionalMixin:
+    """list и retrieve с ETag, посчитанным по объектам до сериализации.
+
+    Объекты всё равно выбираются из базы, но при совпадении ETag
+    сериализаторы не запускаются и тело ответа не передаётся.
+    """
+
+    def get_etag_parts(self, instance):
+        return instance.pk, instance.updated_at
+
+    def get_etag_base(self):
+        return (self.basename, *get_viewer(self.request))
+
+    def get_last_modified(self, instance):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            instances, meta = queryset, None
+        else:
+            instances = page
+            meta = self.get_paginated_response([]).data
+        etag = make_etag(
+            *self.get_etag_base(), meta,
+            *(self.get_etag_parts(instance) for instance in instances)
+        )
+        return conditional_response(
+            request, partial(self.get_list_response, instances, page), etag)
+
+    def get_list_response(self, instances, page):
+        with section('serialize'):
+            data = self.get_serializer(instances, many=True).data
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = make_etag(*self.get_etag_base(), self.get_etag_parts(instance))
+        last_modified = None
+        if not request.user.is_authenticated:
+            # Для пользователя ответ зависит и от его избранного, корзины
+            # и подписок, поэтому ему отдаётся только ETag.
+            last_modified = self.get_last_modified(instance)
+        return conditional_response(
+            request,
+            partial(self.get_retrieve_response, instance),
+            etag,
+            last_modified,
+        )
+
+    def get_retrieve_response(self, instance):
+        with section('serialize'):
+            data = self.get_serializer(instance).data
+        return Response(data)
+
+
+def bump_version(user_id, **changes):
+    FoodgramUser.objects.filter(pk=user_id).update(
+        version=F('version') + 1, **changes)
+
+
+@receiver(post_save, sender=FoodgramUser)
+def bump_profile_version(instance, created, update_fields, **kwargs):
+    if created or (update_fields and not PROFILE_FIELDS & set(update_fields)):
+        return
+    bump_version(instance.pk, profile_updated_at=timezone.now())
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def bump_relations_version(instance, **kwargs):
+    bump_version(instance.user_id)
@@ -0,0 +1,61 @@
+"""Счётчики избранного, корзин, рецептов и подписок.
+
+Значения хранятся в полях Recipe и FoodgramUser и меняются атомарным
+UPDATE с F-выражением при создании и удалении связанных записей, в том
+числе при каскадном удалении. Записи, созданные в обход сигналов
+(bulk_create, правки в базе), учитывает команда refresh_counters.
+"""
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import (
+    FavoriteRecipe, FoodgramUser, Recipe, ShoppingCart, Subscription)
+
+# (модель связи, поле связи, модель со счётчиком, поле счётчика)
+COUNTERS = (
+    (FavoriteRecipe, 'recipe', Recipe, 'favorites_count'),
+    (ShoppingCart, 'recipe', Recipe, 'shopping_carts_count'),
+    (Recipe, 'author', FoodgramUser, 'recipes_count'),
+    (Subscription, 'user', FoodgramUser, 'subscriptions_count'),
+    (Subscription, 'author', FoodgramUser, 'subscribers_count'),
+)
+
+
+def change_counters(instance, delta):
+    for model, field, target, counter in COUNTERS:
+        if isinstance(instance, model):
+            target.objects.filter(
+                pk=getattr(instance, f'{field}_id')
+            ).update(**{counter: Greatest(F(counter) + delta, 0)})
+
+
+def get_actual_counts(target):
+    """Выражения, которые считают значения счётчиков target заново."""
+    return {
+        counter: Coalesce(Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by().values(field)
+            .annotate(count=Count('pk')).values('count')
+        ), Value(0))
+        for model, field, counter_target, counter in COUNTERS
+        if counter_target is target
+    }
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscription)
+def increment_counters(instance, created, **kwargs):
+    if created:
+        change_counters(instance, 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscription)
+def decrement_counters(instance, **kwargs):
+    change_counters(instance, -1)
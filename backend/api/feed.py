@@ -0,0 +1,160 @@
+"""Лента рецептов авторов, на которых подписан пользователь.
+
+Новый рецепт после фиксации транзакции раскладывается в ленты
+подписчиков автора (FeedEntry) пачками по FEED_FANOUT_BATCH_SIZE в пуле
+потоков из FEED_FANOUT_WORKERS, не задерживая ответ на запрос, и
+страница ленты читается одним проходом по индексу записей пользователя.
+Рецепты авторов, у которых подписчиков больше FEED_FANOUT_LIMIT, не
+раскладываются: лента их подписчиков добирает такие рецепты из таблицы
+рецептов при чтении.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, connections, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import FeedEntry, Recipe, Subscription
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+FEED_ORDERING = ('-feed_created_at', '-id')
+FILL_SQL = '''
+    INSERT INTO {feed} (user_id, recipe_id, created_at)
+    SELECT subscription.user_id, recipe.id, recipe.created_at
+    FROM {subscription} AS subscription
+    JOIN {user} AS author ON author.id = subscription.author_id
+    JOIN {recipe} AS recipe ON recipe.author_id = subscription.author_id
+    WHERE author.subscribers_count <= %s
+    ON CONFLICT (user_id, recipe_id) DO NOTHING
+'''
+
+
+def get_feed(user, recipes):
+    """Рецепты из ленты user, отсортированные по дате публикации."""
+    unfanned_authors = Subscription.objects.filter(
+        user=user,
+        author__subscribers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).values('author')
+    if not unfanned_authors.exists():
+        recipes = recipes.filter(feed_entries__user=user).annotate(
+            feed_created_at=F('feed_entries__created_at'))
+    else:
+        recipes = recipes.filter(
+            Q(pk__in=FeedEntry.objects.filter(user=user).values('recipe'))
+            | Q(author__in=unfanned_authors)
+        ).annotate(feed_created_at=F('created_at'))
+    return recipes.order_by(*FEED_ORDERING)
+
+
+def is_fanned_out(author_id):
+    return User.objects.filter(
+        pk=author_id,
+        subscribers_count__lte=settings.FEED_FANOUT_LIMIT,
+    ).exists()
+
+
+def fan_out(recipe_id, author_id, created_at):
+    if not is_fanned_out(author_id):
+        return
+    followers = (
+        Subscription.objects.filter(author_id=author_id)
+        .values_list('user', flat=True)
+        .iterator(chunk_size=settings.FEED_FANOUT_BATCH_SIZE)
+    )
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id, recipe_id=recipe_id, created_at=created_at)
+            for user_id in followers
+        ),
+        batch_size=settings.FEED_FANOUT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+class FanOutQueue:
+    def __init__(self):
+        self.lock = Lock()
+        self.threads = None
+
+    def get_threads(self):
+        with self.lock:
+            if self.threads is None:
+                self.threads = ThreadPoolExecutor(
+                    settings.FEED_FANOUT_WORKERS,
+                    thread_name_prefix='feed-fan-out',
+                )
+            return self.threads
+
+    def submit(self, *args):
+        if not settings.FEED_FANOUT_WORKERS:
+            return fan_out(*args)
+        self.get_threads().submit(self.run_in_thread, *args)
+
+    def run_in_thread(self, *args):
+        try:
+            fan_out(*args)
+        except Exception:
+            logger.exception('Ошибка раскладки рецепта по лентам %s', args)
+        finally:
+            connections.close_all()
+
+
+fan_out_queue = FanOutQueue()
+
+
+def rebuild_feeds():
+    """Заполняет ленты заново по подпискам и рецептам."""
+    tables = {
+        'feed': FeedEntry._meta.db_table,
+        'subscription': Subscription._meta.db_table,
+        'user': User._meta.db_table,
+        'recipe': Recipe._meta.db_table,
+    }
+    with transaction.atomic(), connection.cursor() as cursor:
+        FeedEntry.objects.all().delete()
+        cursor.execute(
+            FILL_SQL.format(**tables), (settings.FEED_FANOUT_LIMIT,))
+        return cursor.rowcount
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(partial(
+            fan_out_queue.submit,
+            instance.pk, instance.author_id, instance.created_at,
+        ))
+
+
+@receiver(post_save, sender=Subscription)
+def add_author_recipes(instance, created, **kwargs):
+    if not created or not is_fanned_out(instance.author_id):
+        return
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=instance.user_id, recipe_id=pk, created_at=created_at)
+            for pk, created_at in Recipe.objects.filter(
+                author_id=instance.author_id
+            ).values_list('pk', 'created_at').iterator()
+        ),
+        batch_size=settings.FEED_FANOUT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+@receiver(post_delete, sender=Subscription)
+def remove_author_recipes(instance, **kwargs):
+    FeedEntry.objects.filter(
+        user_id=instance.user_id, recipe__author_id=instance.author_id
+    ).delete()
@@ -1,12 +1,40 @@
 import django_filters
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import F, Q
 
-from recipes.models import Recipe
+from recipes.models import Ingredient, Recipe
 
 
-class RecipeFilter(django_filters.FilterSet):
+def search_by_name(queryset, query):
+    return (
+        queryset
+        .filter(Q(name__icontains=query) | Q(name__trigram_similar=query))
+        .annotate(similarity=TrigramSimilarity('name', query))
+        .order_by('-similarity', 'name')
+    )
+
+
+class NameSearchFilterSet(django_filters.FilterSet):
+    search = django_filters.CharFilter(method='filter_search')
+
+    def filter_search(self, queryset, name, value):
+        return search_by_name(queryset, value)
+
+
+class IngredientFilter(NameSearchFilterSet):
+    class Meta:
+        model = Ingredient
+        fields = ('search',)
+
+
+class RecipeFilter(NameSearchFilterSet):
     is_favorited = django_filters.NumberFilter(method='filter_is_favorited')
     is_in_shopping_cart = django_filters.NumberFilter(
         method='filter_is_inshopping_cart')
+    ordering = django_filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
@@ -23,3 +51,12 @@ class RecipeFilter(django_filters.FilterSet):
         if user.is_authenticated and value:
             return recipes.filter(shoppingcarts__user=user)
         return recipes
+
+    def filter_ordering(self, recipes, name, value):
+        # Рецепты без записи популярности появляются после пересчёта.
+        return (
+            recipes
+            .filter(score__isnull=False)
+            .annotate(popularity=F('score__score'))
+            .order_by('-popularity', '-pk')
+        )
@@ -0,0 +1,224 @@
+"""Фоновая обработка загруженных изображений.
+
+Поле загрузки только декодирует base64 и проверяет сигнатуру файла,
+исходник сохраняется как есть. Уменьшенные копии (thumb, card, full)
+в WebP и JPEG строятся после фиксации транзакции: в пуле процессов,
+а если его нет или он сломан — в потоке текущего процесса. Готовые
+копии записываются в поле <поле>_variants вместе с именем исходника,
+из которого они получены. Пока копий нет, клиент показывает исходник.
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from io import BytesIO
+from threading import Lock
+
+import filetype
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from drf_extra_fields.fields import Base64FileField
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+from .metrics import IMAGE_PROCESSING
+from recipes.models import FoodgramUser, Recipe
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = {'full': 1280, 'card': 480, 'thumb': 150}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True,
+             'progressive': True},
+}
+IMAGE_FIELDS = {Recipe: 'image', FoodgramUser: 'avatar'}
+
+
+class Base64ImageUploadField(Base64FileField):
+    """Изображение в base64 без декодирования пикселей в запросе."""
+
+    ALLOWED_TYPES = ('jpg', 'png', 'gif', 'webp')
+    INVALID_FILE_MESSAGE = 'Загрузите корректное изображение.'
+    INVALID_TYPE_MESSAGE = 'Неподдерживаемый формат изображения.'
+
+    def get_file_extension(self, filename, decoded_file):
+        return filetype.guess_extension(decoded_file)
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Ссылки на копии изображения или None, пока они не готовы."""
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        urls = {
+            variant: {
+                image_format: default_storage.url(name)
+                for image_format, name in variants[variant].items()
+            }
+            for variant in VARIANT_SIZES
+            if variant in variants
+        }
+        if not urls:
+            return None
+        if request is not None:
+            for formats in urls.values():
+                for image_format, url in formats.items():
+                    formats[image_format] = request.build_absolute_uri(url)
+        return urls
+
+
+def render_variants(data):
+    """Уменьшенные копии изображения: {вариант: {формат: байты}}."""
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        has_alpha = (
+            image.mode in ('RGBA', 'LA', 'PA')
+            or 'transparency' in image.info
+        )
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    rendered = {}
+    # Копии строятся от большей к меньшей, каждая из предыдущей.
+    for variant, size in VARIANT_SIZES.items():
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        opaque = image
+        if has_alpha:
+            opaque = Image.new('RGB', image.size, 'white')
+            opaque.paste(image, mask=image.getchannel('A'))
+        rendered[variant] = {}
+        for image_format, options in FORMATS.items():
+            output = BytesIO()
+            (image if image_format == 'webp' else opaque).save(
+                output, **options)
+            rendered[variant][image_format] = output.getvalue()
+    return rendered
+
+
+def get_variant_name(name, variant, image_format):
+    # Хранилище назовёт файл по хэшу содержимого, здесь важны только
+    # каталог и расширение.
+    directory = name.split('/', 1)[0]
+    return f'{directory}/variants/{variant}.{image_format}'
+
+
+class ImagePipeline:
+    def __init__(self):
+        self.lock = Lock()
+        self.threads = None
+        self.processes = None
+
+    def get_threads(self):
+        with self.lock:
+            if self.threads is None:
+                self.threads = ThreadPoolExecutor(
+                    settings.IMAGE_PIPELINE_WORKERS,
+                    thread_name_prefix='image-pipeline',
+                )
+            return self.threads
+
+    def get_processes(self):
+        with self.lock:
+            if self.processes is None:
+                try:
+                    self.processes = ProcessPoolExecutor(
+                        settings.IMAGE_PIPELINE_WORKERS)
+                except (OSError, NotImplementedError):
+                    logger.warning(
+                        'Пул процессов недоступен, изображения '
+                        'обрабатываются в потоках', exc_info=True)
+                    self.processes = False
+            return self.processes
+
+    def render(self, data):
+        processes = settings.IMAGE_PIPELINE_WORKERS and self.get_processes()
+        if processes:
+            try:
+                return processes.submit(render_variants, data).result()
+            except BrokenProcessPool:
+                logger.warning('Пул процессов сломан, пересоздаётся')
+                with self.lock:
+                    self.processes = None
+        return render_variants(data)
+
+    def schedule(self, model, pk, field_name, name):
+        transaction.on_commit(
+            partial(self.submit, model, pk, field_name, name))
+
+    def submit(self, model, pk, field_name, name):
+        if not settings.IMAGE_PIPELINE_WORKERS:
+            return self.process(model, pk, field_name, name, self.render)
+        self.get_threads().submit(
+            self.run_in_thread, model, pk, field_name, name)
+
+    def run_in_thread(self, *args):
+        try:
+            self.process(*args, self.render)
+        except Exception:
+            logger.exception('Ошибка обработки изображения %s', args)
+        finally:
+            connections.close_all()
+
+    def process(self, model, pk, field_name, name, render):
+        rendered = {}
+        if name:
+            try:
+                with default_storage.open(name, 'rb') as file:
+                    data = file.read()
+            except OSError:
+                logger.warning('Изображение %s не найдено', name)
+                return
+            try:
+                with IMAGE_PROCESSING.labels(model.__name__).time():
+                    rendered = render(data)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                # Битый файл остаётся без копий, клиент покажет исходник.
+                logger.warning(
+                    'Не удалось обработать изображение %s', name,
+                    exc_info=True)
+        self.store(model, pk, field_name, name, rendered)
+
+    def store(self, model, pk, field_name, name, rendered):
+        variants = {'source': name}
+        for variant, formats in rendered.items():
+            variants[variant] = {
+                image_format: default_storage.save(
+                    get_variant_name(name, variant, image_format),
+                    ContentFile(content),
+                )
+                for image_format, content in formats.items()
+            }
+        variants_field = f'{field_name}_variants'
+        # Старые копии не удаляются: одинаковые файлы общие у разных
+        # записей, осиротевшие файлы удаляет команда collect_media.
+        with transaction.atomic():
+            instance = model.objects.select_for_update().filter(
+                pk=pk).first()
+            if (
+                instance is None
+                or (getattr(instance, field_name).name or '') != name
+            ):
+                # Изображение успели заменить или удалить.
+                return
+            setattr(instance, variants_field, variants)
+            instance.save(update_fields=(
+                variants_field,
+                *(field.name for field in model._meta.concrete_fields
+                  if getattr(field, 'auto_now', False)),
+            ))
+
+
+image_pipeline = ImagePipeline()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=FoodgramUser)
+def schedule_image_variants(sender, instance, **kwargs):
+    field_name = IMAGE_FIELDS[sender]
+    name = getattr(instance, field_name).name or ''
+    variants = getattr(instance, f'{field_name}_variants')
+    if variants.get('source', '') != name:
+        image_pipeline.schedule(sender, instance.pk, field_name, name)
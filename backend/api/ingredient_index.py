@@ -0,0 +1,124 @@
+"""Индекс продуктов в памяти процесса для автодополнения по названию.
+
+Каталог продуктов небольшой и меняется редко, поэтому он целиком
+держится в памяти: отсортированный список названий в нижнем регистре
+для поиска по префиксу и заранее сериализованный JSON каждого продукта.
+Индекс строится при запуске процесса сервера (backend.wsgi,
+backend.asgi). При изменении продуктов он сбрасывается в текущем
+процессе, а метка версии в кэше default сообщает об этом остальным, если
+этот кэш общий. С кэшем в памяти процесса (по умолчанию) остальные
+процессы, как и при изменениях в обход сигналов (bulk_create, правки в
+базе), отдают старый индекс и его ETag не дольше INGREDIENT_INDEX_TTL
+секунд.
+"""
+import json
+import logging
+from bisect import bisect_left
+from hashlib import md5
+from threading import Lock
+from time import monotonic
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metrics import count_cache
+from recipes.models import Ingredient
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'ingredient_index_version'
+PREFIX_END = '\U0010ffff'
+
+
+class IngredientIndex:
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.built_at = None
+        self.names = None
+        self.items = None
+        self.digest = None
+
+    def build(self, version):
+        ingredients = sorted(
+            Ingredient.objects.values_list('id', 'name', 'measurement_unit'),
+            key=lambda ingredient: (ingredient[1].casefold(), ingredient[0])
+        )
+        self.names = [name.casefold() for _, name, _ in ingredients]
+        self.items = [
+            json.dumps(
+                {'id': id, 'name': name, 'measurement_unit': unit},
+                ensure_ascii=False,
+            ).encode()
+            for id, name, unit in ingredients
+        ]
+        self.digest = md5(b','.join(self.items)).hexdigest()
+        self.version = version
+        self.built_at = monotonic()
+
+    def is_stale(self, version):
+        return (
+            self.items is None
+            or self.version != version
+            or monotonic() - self.built_at > settings.INGREDIENT_INDEX_TTL
+        )
+
+    def get_snapshot(self):
+        """(названия, продукты, хэш) из одной сборки индекса."""
+        version = cache.get(VERSION_CACHE_KEY)
+        with self.lock:
+            stale = self.is_stale(version)
+            if stale:
+                self.build(version)
+            count_cache('ingredient_index', not stale)
+            return self.names, self.items, self.digest
+
+    def get_built_snapshot(self):
+        """То же без обращения к базе: None, если индекс нужно перестроить."""
+        version = cache.get(VERSION_CACHE_KEY)
+        with self.lock:
+            if self.is_stale(version):
+                return None
+            return self.names, self.items, self.digest
+
+    def get_digest(self):
+        """Хэш каталога: меняется при любом изменении продуктов."""
+        return self.get_snapshot()[2]
+
+    def search(self, prefix='', limit=None, snapshot=None):
+        """JSON-массив продуктов, название которых начинается с prefix."""
+        names, items, _ = snapshot or self.get_snapshot()
+        prefix = prefix.casefold()
+        start = bisect_left(names, prefix)
+        end = bisect_left(names, prefix + PREFIX_END, start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return b'[' + b','.join(items[start:end]) + b']'
+
+    def warm(self):
+        """Строит индекс заранее, чтобы его не ждал первый запрос."""
+        try:
+            self.get_snapshot()
+        except DatabaseError:
+            # Например, до миграций: индекс построится при первом запросе.
+            logger.warning('Индекс продуктов не построен', exc_info=True)
+        finally:
+            connections.close_all()
+
+    def invalidate(self):
+        with self.lock:
+            self.items = None
+        cache.set(VERSION_CACHE_KEY, uuid4().hex, None)
+
+
+ingredient_index = IngredientIndex()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_index.invalidate()
@@ -0,0 +1,201 @@
+import base64
+import json
+import subprocess
+from io import BytesIO
+from statistics import median
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .seed_data import USERNAME_PREFIX
+from api.benchmarking import get_percentiles, measure_ms
+from recipes.models import Ingredient, Recipe
+
+User = get_user_model()
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_image():
+    output = BytesIO()
+    Image.new('RGB', (64, 64), 'orange').save(output, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(output.getvalue()).decode())
+
+
+class Command(BaseCommand):
+    help = ('Замеряет основные сценарии API на заполненной базе (см. '
+            'seed_data): запросов/с, p50/p95/p99 и число запросов к базе. '
+            'Результаты можно сохранить в JSON и сравнить с другим коммитом')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+        parser.add_argument('--compare', help='JSON с прошлыми результатами')
+
+    def handle(self, *args, **options):
+        self.prepare(options['host'])
+        scenarios = self.get_scenarios()
+        names = options['scenarios'] or list(scenarios)
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные сценарии: {", ".join(sorted(unknown))}. '
+                f'Доступны: {", ".join(scenarios)}')
+        baseline = {}
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)['results']
+        results = {}
+        for name in names:
+            results[name] = self.measure(
+                scenarios[name], options['repeat'], options['warmup'])
+            self.report(name, results[name], baseline.get(name))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(
+                    {
+                        'commit': get_commit(),
+                        'dataset': {
+                            'users': User.objects.count(),
+                            'recipes': Recipe.objects.count(),
+                        },
+                        'results': results,
+                    },
+                    file, ensure_ascii=False, indent=2)
+
+    def prepare(self, host):
+        self.user = (
+            User.objects.filter(username__startswith=USERNAME_PREFIX)
+            .order_by('pk').first()
+        )
+        self.recipe = Recipe.objects.filter(author=self.user).first()
+        if self.recipe is None:
+            raise CommandError('Сначала заполните базу командой seed_data')
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = APIClient(HTTP_HOST=host)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.anonymous = APIClient(HTTP_HOST=host)
+        ingredients = Ingredient.objects.values_list('pk', 'name')[:5]
+        self.ingredients = [pk for pk, _ in ingredients]
+        self.prefix = ingredients[0][1][:2]
+        self.image = make_image()
+
+    def get_scenarios(self):
+        get = self.client.get
+        return {
+            'recipes': lambda: get('/api/recipes/'),
+            'recipes_anonymous': lambda: self.anonymous.get('/api/recipes/'),
+            'recipes_by_author': lambda: get(
+                '/api/recipes/', {'author': self.user.pk}),
+            'recipes_favorited': lambda: get(
+                '/api/recipes/', {'is_favorited': 1}),
+            'recipes_in_cart': lambda: get(
+                '/api/recipes/', {'is_in_shopping_cart': 1}),
+            'recipes_search': lambda: get(
+                '/api/recipes/', {'search': 'борщ'}),
+            'recipes_popular': lambda: get(
+                '/api/recipes/',
+                {'ordering': 'popular', 'pagination': 'cursor'}),
+            'recipe_detail': lambda: get(f'/api/recipes/{self.recipe.pk}/'),
+            'feed': lambda: get(
+                '/api/recipes/feed/', {'pagination': 'cursor'}),
+            'subscriptions': lambda: get(
+                '/api/users/subscriptions/', {'recipes_limit': 3}),
+            'shopping_list': self.download_shopping_list,
+            'ingredients_prefix': lambda: get(
+                '/api/ingredients/', {'name': self.prefix}),
+            'ingredients_search': lambda: get(
+                '/api/ingredients/', {'search': self.prefix}),
+            'recipe_create': self.create_recipe,
+            'recipe_update': self.update_recipe,
+        }
+
+    def get_recipe_data(self, name):
+        return {
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': self.image,
+            'ingredients': [
+                {'id': pk, 'amount': amount}
+                for amount, pk in enumerate(self.ingredients, 1)
+            ],
+        }
+
+    def download_shopping_list(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        b''.join(response.streaming_content)
+        return response
+
+    def create_recipe(self):
+        # Изменения откатываются, чтобы замеры повторялись на тех же
+        # данных. Обработчики on_commit (копии изображений, раскладка
+        # по лентам) поэтому не выполняются.
+        with transaction.atomic():
+            response = self.client.post(
+                '/api/recipes/', self.get_recipe_data('Новый рецепт'),
+                format='json')
+            transaction.set_rollback(True)
+        return response
+
+    def update_recipe(self):
+        data = self.get_recipe_data('Изменённый рецепт')
+        data['ingredients'].reverse()
+        with transaction.atomic():
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/', data, format='json')
+            transaction.set_rollback(True)
+        return response
+
+    @staticmethod
+    def measure(scenario, repeat, warmup):
+        for _ in range(warmup):
+            scenario()
+        timings = []
+        queries = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as captured:
+                timing, response = measure_ms(scenario)
+            timings.append(timing)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{response.status_code}: {response.content[:200]}')
+            queries.append(len(captured))
+        return {
+            'rps': round(1000 * repeat / sum(timings), 1),
+            **{
+                name: round(value, 2)
+                for name, value in get_percentiles(timings).items()
+            },
+            'queries': median(queries),
+        }
+
+    def report(self, name, result, baseline=None):
+        line = (
+            f'{name:<20} {result["rps"]:8.1f} запросов/с  '
+            f'p50 {result["p50"]:8.2f}  p95 {result["p95"]:8.2f}  '
+            f'p99 {result["p99"]:8.2f} мс  запросов к базе '
+            f'{result["queries"]:>4}'
+        )
+        if baseline:
+            change = (result['p50'] - baseline['p50']) / baseline['p50']
+            line += (f'  p50 {change:+.0%}, запросов к базе '
+                     f'{result["queries"] - baseline["queries"]:+}')
+        self.stdout.write(line)
@@ -0,0 +1,138 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from api.benchmarking import get_percentiles, measure_ms
+from api.serializers import RecipeSerializer
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+
+User = get_user_model()
+
+BENCHMARK_USERNAME = 'update_benchmark'
+
+
+def replace_ingredients(recipe, ingredients_data):
+    """Прежняя стратегия: удалить все продукты рецепта и вставить заново."""
+    deleted, _ = RecipeIngredient.objects.filter(recipe=recipe).delete()
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(
+            recipe=recipe,
+            ingredient=ingredient['ingredient'],
+            amount=ingredient['amount'],
+        )
+        for ingredient in ingredients_data
+    )
+    return deleted + len(ingredients_data)
+
+
+def diff_ingredients(recipe, ingredients_data):
+    return len(RecipeSerializer.update_ingredients(recipe, ingredients_data))
+
+
+STRATEGIES = {'replace': replace_ingredients, 'diff': diff_ingredients}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает обновление продуктов рецепта заменой всех строк '
+            'и по разнице при параллельных правках')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', type=int, default=60)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--edits', type=int, default=50)
+        parser.add_argument(
+            '--changes',
+            type=int,
+            default=3,
+            help='Сколько продуктов меняется за одну правку',
+        )
+
+    def handle(self, *args, **options):
+        author, _ = User.objects.get_or_create(
+            username=BENCHMARK_USERNAME,
+            defaults={'email': f'{BENCHMARK_USERNAME}@example.com'},
+        )
+        pool = self.get_ingredients(options['ingredients'] * 2)
+        for strategy, update in STRATEGIES.items():
+            recipe = Recipe.objects.create(
+                author=author, name='Рецепт для замеров', text='Текст',
+                image='recipe_images/benchmark.png', cooking_time=10)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in pool[:options['ingredients']]
+            )
+            try:
+                self.run(strategy, update, recipe, pool, options)
+            finally:
+                recipe.delete()
+
+    def run(self, strategy, update, recipe, pool, options):
+        edit = partial(self.edit, update, recipe, pool, options['changes'])
+        started = perf_counter()
+        with ThreadPoolExecutor(options['threads']) as executor:
+            results = list(executor.map(
+                partial(self.timed, edit),
+                range(options['edits'] * options['threads'])
+            ))
+        elapsed = perf_counter() - started
+        percentiles = get_percentiles([timing for timing, _ in results])
+        written = sum(rows for _, rows in results)
+        rows = list(RecipeIngredient.objects.filter(
+            recipe=recipe).values_list('ingredient', flat=True))
+        consistent = len(rows) == len(set(rows)) == options['ingredients']
+        self.stdout.write(
+            f'{strategy:<8} правок {len(results)}, '
+            f'{len(results) / elapsed:7.1f} в с, '
+            f'p50 {percentiles["p50"]:7.2f} мс '
+            f'p95 {percentiles["p95"]:7.2f} мс, '
+            f'строк записано {written} '
+            f'({written / len(results):.1f} на правку), '
+            f'итог {"согласован" if consistent else "НАРУШЕН"}'
+        )
+
+    @staticmethod
+    def timed(edit, number):
+        try:
+            return measure_ms(edit)
+        finally:
+            connections.close_all()
+
+    @staticmethod
+    def edit(update, recipe, pool, changes):
+        with transaction.atomic():
+            Recipe.objects.select_for_update().filter(
+                pk=recipe.pk).values_list('pk').first()
+            amounts = dict(RecipeIngredient.objects.filter(
+                recipe=recipe).values_list('ingredient', 'amount'))
+            for ingredient_id in random.sample(list(amounts), changes):
+                amounts[ingredient_id] += 1
+            # Один продукт заменяется другим из запаса.
+            removed = random.choice(list(amounts))
+            added = random.choice(
+                [ingredient for ingredient in pool
+                 if ingredient.pk not in amounts])
+            del amounts[removed]
+            amounts[added.pk] = 1
+            ingredients = {ingredient.pk: ingredient for ingredient in pool}
+            return update(recipe, [
+                {'ingredient': ingredients[pk], 'amount': amount}
+                for pk, amount in amounts.items()
+            ])
+
+    @staticmethod
+    def get_ingredients(count):
+        ingredients = list(Ingredient.objects.all()[:count])
+        if len(ingredients) < count:
+            Ingredient.objects.bulk_create((
+                Ingredient(name=f'Продукт для замеров {number}',
+                           measurement_unit='г')
+                for number in range(len(ingredients), count)
+            ), ignore_conflicts=True)
+            ingredients = list(Ingredient.objects.all()[:count])
+        return ingredients
@@ -0,0 +1,103 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.benchmarking import get_percentiles, make_recipe_name, measure_ms
+from api.filters import search_by_name
+from recipes.models import Recipe
+
+User = get_user_model()
+
+BENCHMARK_USERNAME = 'search_benchmark'
+QUERIES = ('борщ', 'салат', 'сырн', 'запеканк', 'пирк', 'котлты')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск рецептов по началу названия (istartswith) '
+            'с триграммным поиском')
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=QUERIES)
+        parser.add_argument('--recipes', type=int, default=1_000_000)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Оставить созданные для замеров рецепты в базе; по '
+                 'умолчанию транзакция с ними откатывается',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options['recipes'], options['batch_size'])
+            self.analyze()
+            self.measure(options['queries'], options['repeat'],
+                         options['limit'])
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def measure(self, queries, repeat, limit):
+        methods = {
+            'istartswith': lambda query: Recipe.objects.filter(
+                name__istartswith=query),
+            'trigram': lambda query: search_by_name(
+                Recipe.objects.all(), query),
+        }
+        for query in queries:
+            for method, get_queryset in methods.items():
+                queryset = get_queryset(query)[:limit]
+                timings = []
+                for _ in range(repeat):
+                    timing, found = measure_ms(
+                        lambda: len(list(queryset.all())))
+                    timings.append(timing)
+                percentiles = get_percentiles(timings)
+                self.stdout.write(
+                    f'{query:<12} {method:<12} найдено {found:>3} '
+                    f'p50 {percentiles["p50"]:8.2f} мс '
+                    f'p95 {percentiles["p95"]:8.2f} мс | '
+                    f'{self.get_scan(queryset)}'
+                )
+
+    @staticmethod
+    def analyze():
+        # Без свежей статистики планировщик оценивает таблицу по старому
+        # числу строк и выбирает планы, которых не будет в работе.
+        with connection.cursor() as cursor:
+            for model in (Recipe, User):
+                table = connection.ops.quote_name(model._meta.db_table)
+                cursor.execute(f'ANALYZE {table}')
+
+    @staticmethod
+    def get_scan(queryset):
+        plan = queryset.explain().splitlines()
+        return next(
+            (line.strip(' ->') for line in plan if 'Scan' in line), plan[0])
+
+    def seed(self, total, batch_size):
+        missing = total - Recipe.objects.count()
+        if missing <= 0:
+            return
+        author, _ = User.objects.get_or_create(
+            username=BENCHMARK_USERNAME,
+            defaults={'email': f'{BENCHMARK_USERNAME}@example.com'},
+        )
+        self.stdout.write(f'Создаём {missing} рецептов...')
+        while missing > 0:
+            size = min(batch_size, missing)
+            Recipe.objects.bulk_create(
+                Recipe(
+                    author=author,
+                    name=make_recipe_name(
+                        random, random.randint(1, 999)).capitalize(),
+                    text='Рецепт для замеров поиска',
+                    image='recipe_images/benchmark.png',
+                    cooking_time=random.randint(5, 180),
+                )
+                for _ in range(size)
+            )
+            missing -= size
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.images import IMAGE_FIELDS, image_pipeline
+
+
+class Command(BaseCommand):
+    help = ('Строит недостающие копии изображений рецептов и аватарок, '
+            'например для файлов, загруженных до появления копий')
+
+    def handle(self, *args, **options):
+        built = 0
+        for model, field_name in IMAGE_FIELDS.items():
+            images = model.objects.exclude(**{field_name: ''}).values_list(
+                'pk', field_name, f'{field_name}_variants')
+            for pk, name, variants in images.iterator():
+                if variants.get('source') != name:
+                    image_pipeline.process(
+                        model, pk, field_name, name, image_pipeline.render)
+                    built += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {built}'))
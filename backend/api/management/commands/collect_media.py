@@ -0,0 +1,78 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.images import IMAGE_FIELDS, VARIANT_SIZES
+
+
+class Command(BaseCommand):
+    help = ('Удаляет файлы изображений, на которые не ссылается ни один '
+            'рецепт или пользователь')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace',
+            type=float,
+            default=24,
+            help='Не трогать файлы моложе указанного числа часов: на них '
+                 'могут ссылаться ещё не завершённые запросы',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено',
+        )
+
+    def handle(self, *args, **options):
+        references = self.count_references()
+        deadline = timezone.now() - timedelta(hours=options['grace'])
+        files = orphans = freed = 0
+        for model, field_name in IMAGE_FIELDS.items():
+            directory = model._meta.get_field(field_name).upload_to
+            for name in self.walk(directory):
+                files += 1
+                if (
+                    references[name]
+                    or default_storage.get_modified_time(name) > deadline
+                ):
+                    continue
+                orphans += 1
+                freed += default_storage.size(name)
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    default_storage.delete(name)
+        shared = sum(count > 1 for count in references.values())
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Файлов: {files}, общих для нескольких записей: {shared}. '
+            f'{action} файлов: {orphans}, {freed / 2 ** 20:.1f} МБ'
+        ))
+
+    @staticmethod
+    def count_references():
+        references = Counter()
+        for model, field_name in IMAGE_FIELDS.items():
+            rows = model.objects.values_list(
+                field_name, f'{field_name}_variants')
+            for name, variants in rows.iterator():
+                references[name] += 1
+                references.update(
+                    variant_name
+                    for variant in VARIANT_SIZES
+                    for variant_name in variants.get(variant, {}).values()
+                )
+        references.pop('', None)
+        return references
+
+    def walk(self, directory):
+        if not default_storage.exists(directory):
+            return
+        directories, files = default_storage.listdir(directory)
+        for name in files:
+            yield f'{directory}/{name}'
+        for name in directories:
+            yield from self.walk(f'{directory}/{name}')
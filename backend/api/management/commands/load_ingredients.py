@@ -0,0 +1,212 @@
+import csv
+import json
+import os
+from io import StringIO
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.ingredient_index import ingredient_index
+from api.recipe_cache import recipe_cache
+from recipes.models import Ingredient, RecipeIngredient
+
+FORMATS = ('json', 'csv')
+CSV_HEADER = ['name', 'measurement_unit']
+MAX_LENGTH = 150
+
+CREATE_STAGING_SQL = '''
+    CREATE TEMPORARY TABLE ingredient_import (
+        name text, measurement_unit text
+    )
+'''
+COPY_SQL = '''
+    COPY ingredient_import (name, measurement_unit)
+    FROM STDIN WITH (FORMAT csv)
+'''
+# Продукт с тем же названием получает единицу измерения из файла, если
+# название в каталоге и в пачке однозначно. id продукта сохраняется,
+# так что рецепты продолжают на него ссылаться.
+UPDATE_SQL = '''
+    UPDATE {table} AS ingredient
+    SET measurement_unit = imported.measurement_unit
+    FROM (
+        SELECT name, min(measurement_unit) AS measurement_unit
+        FROM ingredient_import
+        GROUP BY name
+        HAVING count(DISTINCT measurement_unit) = 1
+    ) AS imported
+    WHERE ingredient.name = imported.name
+        AND ingredient.measurement_unit <> imported.measurement_unit
+        AND NOT EXISTS (
+            SELECT 1 FROM {table} AS other
+            WHERE other.name = ingredient.name AND other.id <> ingredient.id
+        )
+    RETURNING ingredient.id
+'''
+INSERT_SQL = '''
+    INSERT INTO {table} (name, measurement_unit)
+    SELECT DISTINCT name, measurement_unit FROM ingredient_import
+    ON CONFLICT (name, measurement_unit) DO NOTHING
+'''
+
+
+def iter_json_array(file, chunk_size=64 * 1024):
+    """Элементы JSON-массива из файла без загрузки его целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Ожидался JSON-массив')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                # Элемент не поместился в буфер, читаем дальше.
+                break
+            yield item
+        if not chunk:
+            raise ValueError('Неожиданный конец JSON-массива')
+
+
+def iter_csv_rows(file):
+    rows = csv.reader(file)
+    for row in rows:
+        if row == CSV_HEADER:
+            continue
+        yield dict(zip(CSV_HEADER, row))
+
+
+class Command(BaseCommand):
+    help = ('Загружает продукты из JSON или CSV потоком, пачками через '
+            'COPY во временную таблицу')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', type=str)
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Формат файла; по умолчанию определяется по расширению',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--update',
+            action='store_true',
+            help='Обновлять единицу измерения продукта с тем же названием '
+                 'вместо добавления нового',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Загрузка продуктов требует PostgreSQL')
+        path = options['file']
+        if not os.path.exists(path):
+            path = os.path.join(settings.BASE_DIR, 'data', path)
+        file_format = (
+            options['format'] or os.path.splitext(path)[1][1:].lower())
+        if file_format not in FORMATS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        self.counts = dict.fromkeys(
+            ('inserted', 'updated', 'skipped', 'invalid'), 0)
+        self.updated_ids = []
+        started = perf_counter()
+        try:
+            with open(path, encoding='utf-8', newline='') as file, \
+                    transaction.atomic():
+                rows = (
+                    iter_json_array(file) if file_format == 'json'
+                    else iter_csv_rows(file)
+                )
+                self.load(rows, options['batch_size'], options['update'])
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Ошибка при загрузке {path}: {error}')
+        self.invalidate_caches()
+        elapsed = perf_counter() - started
+        total = sum(self.counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            'Продукты загружены. Добавлено: {inserted}, обновлено: '
+            '{updated}, пропущено: {skipped}, с ошибками: {invalid}. '
+            .format(**self.counts)
+            + f'{total} строк за {elapsed:.2f} с, '
+            f'{total / elapsed:.0f} строк/с'
+        ))
+
+    def load(self, rows, batch_size, update):
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_STAGING_SQL)
+            buffer = StringIO()
+            writer = csv.writer(buffer)
+            size = 0
+            for row in rows:
+                row = self.clean(row)
+                if row is None:
+                    continue
+                writer.writerow(row)
+                size += 1
+                if size == batch_size:
+                    self.merge(cursor, table, buffer, size, update)
+                    buffer.seek(0)
+                    buffer.truncate()
+                    size = 0
+            if size:
+                self.merge(cursor, table, buffer, size, update)
+            cursor.execute('DROP TABLE ingredient_import')
+
+    def clean(self, row):
+        try:
+            name = row['name'].strip()
+            unit = row['measurement_unit'].strip()
+        except (AttributeError, KeyError, TypeError):
+            name = unit = ''
+        if not name or not unit or max(len(name), len(unit)) > MAX_LENGTH:
+            self.counts['invalid'] += 1
+            self.stderr.write(f'Пропущена некорректная строка: {row}')
+            return None
+        return name, unit
+
+    def merge(self, cursor, table, buffer, size, update):
+        buffer.seek(0)
+        cursor.copy_expert(COPY_SQL, buffer)
+        updated = 0
+        if update:
+            cursor.execute(UPDATE_SQL.format(table=table))
+            ids = [row[0] for row in cursor.fetchall()]
+            self.updated_ids.extend(ids)
+            updated = len(ids)
+        cursor.execute(INSERT_SQL.format(table=table))
+        inserted = cursor.rowcount
+        cursor.execute('TRUNCATE ingredient_import')
+        self.counts['inserted'] += inserted
+        self.counts['updated'] += updated
+        self.counts['skipped'] += size - inserted - updated
+
+    def invalidate_caches(self):
+        # Массовая загрузка идёт в обход сигналов модели.
+        if not (self.counts['inserted'] or self.counts['updated']):
+            return
+        ingredient_index.invalidate()
+        if self.updated_ids:
+            recipe_cache.invalidate(set(
+                RecipeIngredient.objects.filter(
+                    ingredient__in=self.updated_ids
+                ).values_list('recipe', flat=True)
+            ))
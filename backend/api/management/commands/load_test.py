@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarking import get_percentiles, measure_ms
+from recipes.models import Ingredient, Recipe
+
+PATHS = (
+    '/api/recipes/',
+    '/api/recipes/{recipe}/',
+    '/api/ingredients/?name={prefix}',
+    '/s/{recipe}/',
+)
+# Адреса, которые проверяются только с --token.
+AUTHENTICATED_PATHS = (
+    '/api/recipes/download_shopping_cart/',
+)
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест запросов на чтение: пропускная способность и '
+            'p99 по каждому адресу. Запустите его против сервера в режиме '
+            'SERVER_MODE=wsgi и SERVER_MODE=asgi и сравните результаты')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*')
+        parser.add_argument('--url', default='http://localhost:8000')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--token', help='Токен авторизации')
+
+    def handle(self, *args, **options):
+        recipe = Recipe.objects.values_list('pk', flat=True).first()
+        ingredient = Ingredient.objects.values_list('name', flat=True).first()
+        if recipe is None or ingredient is None:
+            raise CommandError('Нужен хотя бы один рецепт и продукт')
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        paths = options['paths'] or (
+            PATHS + AUTHENTICATED_PATHS if options['token'] else PATHS)
+        for path in paths:
+            url = options['url'] + path.format(
+                recipe=recipe, prefix=ingredient[:2])
+            self.run(url, headers, options['concurrency'],
+                     options['requests'])
+
+    def run(self, url, headers, concurrency, total):
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(
+            pool_connections=concurrency, pool_maxsize=concurrency))
+
+        def fetch(_):
+            timing, response = measure_ms(
+                session.get, url, headers=headers, allow_redirects=False)
+            return timing, response.status_code < 400
+
+        # Прогрев: кэши и индекс продуктов заполняются до замера.
+        fetch(None)
+        started = perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(fetch, range(total)))
+        elapsed = perf_counter() - started
+        percentiles = get_percentiles([timing for timing, _ in results])
+        errors = sum(not ok for _, ok in results)
+        self.stdout.write(
+            f'{url}\n'
+            f'  {total / elapsed:8.0f} запросов/с, ошибок {errors}, '
+            f'p50 {percentiles["p50"]:7.2f} мс, '
+            f'p99 {percentiles["p99"]:7.2f} мс'
+        )
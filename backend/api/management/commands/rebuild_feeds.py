@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api.feed import rebuild_feeds
+
+
+class Command(BaseCommand):
+    help = ('Заполняет ленты подписчиков заново, например после изменения '
+            'FEED_FANOUT_LIMIT')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты заполнены. Записей: {rebuild_feeds()}'))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from api.counters import COUNTERS, get_actual_counts
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного, корзин, рецептов '
+            'и подписок')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить счётчики, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        targets = dict.fromkeys(target for _, _, target, _ in COUNTERS)
+        if options['check']:
+            return self.check_counters(targets)
+        fixed = sum(
+            target.objects.filter(
+                pk__in=self.get_stale(target).values('pk')
+            ).update(**get_actual_counts(target))
+            for target in targets
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Счётчики пересчитаны. Исправлено записей: {fixed}'))
+
+    @staticmethod
+    def get_stale(target):
+        """Записи target, у которых хотя бы один счётчик расходится."""
+        counts = get_actual_counts(target)
+        return target.objects.annotate(**{
+            f'actual_{counter}': expression
+            for counter, expression in counts.items()
+        }).filter(Q(
+            *(~Q(**{counter: F(f'actual_{counter}')}) for counter in counts),
+            _connector=Q.OR,
+        ))
+
+    def check_counters(self, targets):
+        mismatches = 0
+        for target in targets:
+            counters = list(get_actual_counts(target))
+            actual = [f'actual_{counter}' for counter in counters]
+            rows = self.get_stale(target).values_list(
+                'pk', *counters, *actual)
+            for pk, *values in rows.iterator():
+                stored = dict(zip(counters, values))
+                expected = dict(zip(counters, values[len(counters):]))
+                for counter in counters:
+                    if stored[counter] != expected[counter]:
+                        mismatches += 1
+                        self.stderr.write(
+                            f'{target._meta.verbose_name} {pk}, {counter}: '
+                            f'сохранено {stored[counter]}, '
+                            f'должно быть {expected[counter]}'
+                        )
+        if mismatches:
+            raise CommandError(f'Найдено расхождений: {mismatches}')
+        self.stdout.write(self.style.SUCCESS('Расхождений не найдено'))
@@ -0,0 +1,178 @@
+import random
+from itertools import islice
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+
+from api.benchmarking import make_recipe_name
+from api.feed import rebuild_feeds
+from api.ingredient_index import ingredient_index
+from api.popularity import refresh_scores
+from api.recipe_cache import recipe_cache
+from recipes.models import (
+    FavoriteRecipe, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    ShoppingCartIngredient, Subscription)
+
+User = get_user_model()
+
+USERNAME_PREFIX = 'seed_user'
+PASSWORD = 'seed-password'
+
+
+def raw_delete(queryset):
+    """Удаляет записи queryset вместе с зависимыми по CASCADE.
+
+    Каждая таблица очищается одним DELETE без загрузки объектов и без
+    сигналов, поэтому производные данные нужно пересчитать отдельно.
+    """
+    model = queryset.model
+    for field in model._meta.many_to_many:
+        through = field.remote_field.through
+        if through._meta.auto_created:
+            raw_delete(through.objects.filter(
+                **{f'{field.m2m_field_name()}__in': queryset}))
+    for relation in model._meta.related_objects:
+        if relation.on_delete is models.CASCADE:
+            raw_delete(relation.related_model._base_manager.filter(
+                **{f'{relation.field.name}__in': queryset}))
+    queryset._raw_delete(queryset.db)
+
+
+def batched(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, рецептами, '
+            'избранным, корзинами и подписками для нагрузочных тестов. '
+            'При одинаковых параметрах и --seed данные одинаковы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients', type=int, nargs=2, default=(3, 12),
+            metavar=('MIN', 'MAX'), help='Продуктов в рецепте')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Избранных рецептов у пользователя')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Рецептов в корзине у пользователя')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Подписок у пользователя')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Удалить данные предыдущего заполнения')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        seed_users = User.objects.filter(
+            username__startswith=USERNAME_PREFIX)
+        if options['clear']:
+            # Каскадное удаление через ORM вызвало бы сигналы на каждую
+            # запись; производные данные пересчитываются ниже.
+            with transaction.atomic():
+                recipe_cache.invalidate(list(Recipe.objects.filter(
+                    author__in=seed_users).values_list('pk', flat=True)))
+                raw_delete(seed_users)
+        elif seed_users.exists():
+            raise CommandError(
+                'Данные уже заполнены, запустите команду с --clear')
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', 'ingredients.json',
+                         stdout=self.stdout)
+        started = perf_counter()
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            recipes = self.create_recipes(
+                users, options['recipes'], options['ingredients'])
+            self.create_relations(
+                FavoriteRecipe, users, recipes, options['favorites'])
+            self.create_relations(
+                ShoppingCart, users, recipes, options['carts'])
+            self.create_subscriptions(users, options['subscriptions'])
+        self.stdout.write('Пересчёт производных данных...')
+        # Массовые вставки идут в обход сигналов.
+        ShoppingCartIngredient.objects.refresh()
+        call_command('refresh_counters', stdout=self.stdout)
+        refresh_scores()
+        rebuild_feeds()
+        ingredient_index.invalidate()
+        recipe_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные заполнены за {perf_counter() - started:.1f} с'))
+
+    def bulk_create(self, model, objects):
+        created = []
+        for batch in batched(objects, self.batch_size):
+            created.extend(model.objects.bulk_create(batch))
+        self.stdout.write(f'{model._meta.verbose_name_plural}: {len(created)}')
+        return created
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        return self.bulk_create(User, (
+            User(
+                username=f'{USERNAME_PREFIX}{i}',
+                email=f'{USERNAME_PREFIX}{i}@example.com',
+                first_name='Имя', last_name='Фамилия', password=password,
+            )
+            for i in range(count)
+        ))
+
+    def create_recipes(self, users, count, ingredients_range):
+        ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+        recipes = self.bulk_create(Recipe, (
+            Recipe(
+                author=self.random.choice(users),
+                name=make_recipe_name(self.random, i),
+                text='Описание рецепта',
+                image='recipe_images/seed.png',
+                cooking_time=self.random.randint(5, 180),
+            )
+            for i in range(count)
+        ))
+        low, high = ingredients_range
+        self.bulk_create(RecipeIngredient, (
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient,
+                amount=self.random.randint(1, 500),
+            )
+            for recipe in recipes
+            for ingredient in self.random.sample(
+                ingredients, min(len(ingredients),
+                                 self.random.randint(low, high)))
+        ))
+        return recipes
+
+    def create_relations(self, model, users, recipes, per_user):
+        return self.bulk_create(model, (
+            model(user=user, recipe=recipe)
+            for user in users
+            for recipe in self.random.sample(
+                recipes, min(len(recipes), per_user))
+        ))
+
+    def create_subscriptions(self, users, per_user):
+        # Подписки распределены неравномерно: на первых авторов
+        # подписываются чаще, как на популярных в жизни.
+        weights = [1 / (rank + 1) for rank in range(len(users))]
+        subscriptions = set()
+        for user in users:
+            authors = self.random.choices(users, weights, k=per_user)
+            subscriptions.update(
+                (user, author) for author in authors if author != user)
+        return self.bulk_create(Subscription, (
+            Subscription(user=user, author=author)
+            for user, author in sorted(
+                subscriptions, key=lambda pair: (pair[0].pk, pair[1].pk))
+        ))
@@ -0,0 +1,124 @@
+"""Метрики Prometheus, отдаются по GET /metrics.
+
+Под gunicorn каждый воркер пишет значения в файлы каталога
+PROMETHEUS_MULTIPROC_DIR (его создаёт gunicorn.conf.py), и /metrics
+суммирует их по всем процессам. Без этой переменной метрики хранятся в
+памяти процесса. Наружу адрес не публикуется: nginx не проксирует
+/metrics, Prometheus обращается к backend напрямую, а запросы с адресов
+вне METRICS_ALLOWED_NETWORKS получают 404.
+"""
+import os
+from ipaddress import ip_address, ip_network
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+    generate_latest, multiprocess)
+
+from .profiling import QueryCounter, count_queries
+
+REQUEST_DURATION = Histogram(
+    'foodgram_request_duration_seconds',
+    'Время обработки запроса',
+    ('view', 'method', 'status'),
+)
+DB_QUERIES = Counter(
+    'foodgram_db_queries', 'Запросы к базе данных', ('view',))
+DB_DURATION = Counter(
+    'foodgram_db_query_seconds', 'Время запросов к базе данных', ('view',))
+CACHE_REQUESTS = Counter(
+    'foodgram_cache_requests', 'Обращения к кэшам', ('cache', 'result'))
+IMAGE_PROCESSING = Histogram(
+    'foodgram_image_processing_seconds',
+    'Время построения копий изображения',
+    ('model',),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+SHOPPING_LIST_SIZE = Histogram(
+    'foodgram_shopping_list_bytes',
+    'Размер выгруженного списка покупок',
+    ('format',),
+    buckets=tuple(2 ** power for power in range(9, 23, 2)),
+)
+TOKEN_LOOKUP = Histogram(
+    'foodgram_token_lookup_seconds',
+    'Время проверки токена авторизации',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+
+def count_cache(cache_name, hit):
+    CACHE_REQUESTS.labels(cache_name, 'hit' if hit else 'miss').inc()
+
+
+def measure_stream(chunks, histogram):
+    """Отдаёт chunks без изменений и записывает их общий размер."""
+    size = 0
+    for chunk in chunks:
+        size += len(chunk.encode() if isinstance(chunk, str) else chunk)
+        yield chunk
+    histogram.observe(size)
+
+
+class MetricsMiddleware:
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        started = perf_counter()
+        with count_queries(QueryCounter()) as counter:
+            response = self.get_response(request)
+        return self.observe(request, response, counter, started)
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        started = perf_counter()
+        with count_queries(QueryCounter()) as counter:
+            response = await self.get_response(request)
+        return self.observe(request, response, counter, started)
+
+    @staticmethod
+    def observe(request, response, counter, started):
+        duration = perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        REQUEST_DURATION.labels(
+            view, request.method, response.status_code).observe(duration)
+        if counter.queries:
+            DB_QUERIES.labels(view).inc(counter.queries)
+            DB_DURATION.labels(view).inc(counter.db_time)
+        return response
+
+
+def is_allowed(address):
+    try:
+        address = ip_address(address)
+    except ValueError:
+        return False
+    return any(
+        address in ip_network(network)
+        for network in settings.METRICS_ALLOWED_NETWORKS
+    )
+
+
+def metrics(request):
+    if not is_allowed(request.META.get('REMOTE_ADDR', '')):
+        raise Http404
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -1,6 +1,62 @@
-from rest_framework.pagination import PageNumberPagination
+from django.db import connections
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+APPROXIMATE_COUNT_HEADER = 'X-Approximate-Count'
+
+
+def get_approximate_count(queryset):
+    """Оценка числа строк по плану запроса PostgreSQL, без COUNT(*)."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    if queryset.query.is_empty():
+        return 0
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return plan[0]['Plan']['Plan Rows']
 
 
 class FoodgramPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_query_param = 'page'
+
+
+class FoodgramCursorPagination(CursorPagination):
+    """Пагинация по ключу для бесконечной ленты.
+
+    Включается параметром ?pagination=cursor. Вместо точного count можно
+    запросить оценку числа записей в заголовке: ?count=approximate.
+    """
+
+    page_size_query_param = 'limit'
+    ordering = ('-created_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.approximate_count = None
+        if request.query_params.get('count') == 'approximate':
+            self.approximate_count = get_approximate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.approximate_count is not None:
+            response[APPROXIMATE_COUNT_HEADER] = self.approximate_count
+        return response
+
+
+class CursorPaginationMixin:
+    cursor_pagination_class = FoodgramCursorPagination
+
+    @property
+    def paginator(self):
+        if (
+            not hasattr(self, '_paginator')
+            and self.request.query_params.get('pagination') == 'cursor'
+        ):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
@@ -0,0 +1,94 @@
+"""Популярность рецептов для сортировки ?ordering=popular.
+
+Каждое добавление в избранное или корзину весит WEIGHTS[модель] и
+затухает вдвое за POPULARITY_HALF_LIFE_DAYS дней. Чтобы сортировка шла
+по индексу, хранится не текущее значение, а вклады, приведённые к
+моменту EPOCH: вес * 2 ** ((t - EPOCH) / период). Все вклады затухают
+с одной скоростью, поэтому порядок по приведённой сумме совпадает с
+порядком по текущей, и новое событие просто прибавляет свой вклад, а
+удаление вычитает его. При периоде 7 дней значения помещаются в float
+ещё около 19 лет после EPOCH.
+"""
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db.models import (
+    F, FloatField, Func, OuterRef, Subquery, Sum, Value)
+from django.db.models.functions import Coalesce, Power
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import FavoriteRecipe, Recipe, RecipeScore, ShoppingCart
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+WEIGHTS = {FavoriteRecipe: 1.0, ShoppingCart: 2.0}
+
+
+def get_half_life():
+    return settings.POPULARITY_HALF_LIFE_DAYS * 24 * 60 * 60
+
+
+def get_contribution(model, created_at):
+    return WEIGHTS[model] * 2 ** (
+        (created_at - EPOCH).total_seconds() / get_half_life())
+
+
+def get_actual_score():
+    """Популярность рецепта, посчитанная заново по избранному и корзинам."""
+    scores = []
+    for model, weight in WEIGHTS.items():
+        seconds = Func(
+            F('created_at'),
+            template='EXTRACT(EPOCH FROM %(expressions)s)',
+            output_field=FloatField(),
+        ) - EPOCH.timestamp()
+        contributions = (
+            model.objects.filter(recipe=OuterRef('recipe'))
+            .order_by().values('recipe')
+            .annotate(total=Sum(
+                weight * Power(Value(2.0), seconds / get_half_life())))
+            .values('total')
+        )
+        scores.append(Coalesce(
+            Subquery(contributions, output_field=FloatField()), Value(0.0)))
+    return sum(scores[1:], scores[0])
+
+
+def refresh_scores():
+    """Создаёт недостающие записи и пересчитывает популярность заново."""
+    RecipeScore.objects.bulk_create(
+        (
+            RecipeScore(recipe_id=pk)
+            for pk in Recipe.objects.filter(
+                score__isnull=True).values_list('pk', flat=True).iterator()
+        ),
+        ignore_conflicts=True,
+    )
+    return RecipeScore.objects.update(score=get_actual_score())
+
+
+@receiver(post_save, sender=Recipe)
+def create_score(instance, created, **kwargs):
+    if created:
+        RecipeScore.objects.get_or_create(recipe=instance)
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+def add_contribution(sender, instance, created, **kwargs):
+    if not created:
+        return
+    contribution = get_contribution(sender, instance.created_at)
+    scores = RecipeScore.objects.filter(recipe_id=instance.recipe_id)
+    if not scores.update(score=F('score') + contribution):
+        # Рецепт создан в обход сигналов (bulk_create).
+        RecipeScore.objects.get_or_create(
+            recipe_id=instance.recipe_id, defaults={'score': contribution})
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingCart)
+def remove_contribution(sender, instance, **kwargs):
+    # Запись не создаётся: при каскадном удалении рецепта её уже нет.
+    RecipeScore.objects.filter(recipe_id=instance.recipe_id).update(
+        score=F('score') - get_contribution(sender, instance.created_at))
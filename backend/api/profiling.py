@@ -0,0 +1,206 @@
+"""Профилирование запросов к базе по каждому HTTP-запросу.
+
+Включается настройкой QUERY_PROFILING. Для каждого запроса считаются
+число запросов к базе и время в ней, повторяющиеся запросы (одинаковый
+SQL с разными параметрами — признак N+1) и время сериализации. Итоги
+отдаются в заголовке Server-Timing и пишутся в лог api.profiling одной
+строкой JSON. Если запросов больше QUERY_BUDGET или один и тот же запрос
+повторяется больше QUERY_DUPLICATES_LIMIT раз, запись идёт с уровнем
+WARNING, а при QUERY_BUDGET_RAISE — выбрасывается QueryBudgetExceeded,
+чтобы такой эндпоинт валил тесты.
+
+Запросы к базе попадают к счётчикам текущего HTTP-запроса через
+контекстную переменную, поэтому они учитываются и под ASGI, где
+представление выполняется в другом потоке, чем промежуточный слой.
+"""
+import json
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+current_profile = ContextVar('current_profile', default=None)
+current_counters = ContextVar('current_counters', default=())
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+SPACES = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def get_fingerprint(sql):
+    """SQL без параметров, со списками IN (...) любой длины как один."""
+    return IN_LIST.sub('IN (...)', SPACES.sub(' ', sql))
+
+
+class QueryCounter:
+    """Обёртка connection.execute_wrapper: число запросов и время в базе."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.queries += 1
+            self.record(sql)
+
+    def record(self, sql):
+        pass
+
+
+class Profile(QueryCounter):
+    def __init__(self):
+        super().__init__()
+        self.fingerprints = Counter()
+        self.sections = Counter()
+
+    def record(self, sql):
+        self.fingerprints[get_fingerprint(sql)] += 1
+
+    def get_duplicates(self):
+        return {
+            fingerprint: count
+            for fingerprint, count in self.fingerprints.most_common()
+            if count > 1
+        }
+
+
+def execute_with_counters(execute, sql, params, many, context):
+    for counter in current_counters.get():
+        execute = partial(counter, execute)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_counters(connection, **kwargs):
+    # Соединения создаются в каждом потоке свои, в том числе в потоке
+    # синхронных представлений под ASGI.
+    if execute_with_counters not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_with_counters)
+
+
+@contextmanager
+def count_queries(counter):
+    """Передаёт counter запросы к базе, выполненные внутри блока."""
+    token = current_counters.set((*current_counters.get(), counter))
+    try:
+        yield counter
+    finally:
+        current_counters.reset(token)
+
+
+@contextmanager
+def section(name):
+    """Замеряет время части обработки запроса, например сериализации."""
+    profile = current_profile.get()
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.sections[name] += perf_counter() - started
+
+
+def get_problems(profile):
+    problems = []
+    if settings.QUERY_BUDGET and profile.queries > settings.QUERY_BUDGET:
+        problems.append(
+            f'{profile.queries} запросов при бюджете {settings.QUERY_BUDGET}')
+    for fingerprint, count in profile.get_duplicates().items():
+        if count > settings.QUERY_DUPLICATES_LIMIT:
+            problems.append(f'{count} одинаковых запросов: {fingerprint}')
+    return problems
+
+
+def get_server_timing(profile, total):
+    duplicates = sum(count - 1 for count in profile.get_duplicates().values())
+    metrics = [
+        f'db;dur={profile.db_time * 1000:.1f};'
+        f'desc="{profile.queries} queries, {duplicates} duplicated"',
+        *(
+            f'{name};dur={duration * 1000:.1f}'
+            for name, duration in profile.sections.items()
+        ),
+        f'total;dur={total * 1000:.1f}',
+    ]
+    return ', '.join(metrics)
+
+
+@contextmanager
+def profiling(profile):
+    token = current_profile.set(profile)
+    try:
+        with count_queries(profile):
+            yield profile
+    finally:
+        current_profile.reset(token)
+
+
+class QueryProfilingMiddleware:
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.QUERY_PROFILING:
+            return self.get_response(request)
+        started = perf_counter()
+        with profiling(Profile()) as profile:
+            response = self.get_response(request)
+        return self.report(request, response, profile, started)
+
+    async def __acall__(self, request):
+        if not settings.QUERY_PROFILING:
+            return await self.get_response(request)
+        started = perf_counter()
+        with profiling(Profile()) as profile:
+            response = await self.get_response(request)
+        return self.report(request, response, profile, started)
+
+    @staticmethod
+    def report(request, response, profile, started):
+        total = perf_counter() - started
+        response['Server-Timing'] = get_server_timing(profile, total)
+        problems = get_problems(profile)
+        logger.log(
+            logging.WARNING if problems else logging.INFO,
+            json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'queries': profile.queries,
+                'db_ms': round(profile.db_time * 1000, 1),
+                'total_ms': round(total * 1000, 1),
+                **{
+                    f'{name}_ms': round(duration * 1000, 1)
+                    for name, duration in profile.sections.items()
+                },
+                'duplicates': profile.get_duplicates(),
+                'problems': problems,
+            }, ensure_ascii=False),
+        )
+        if problems and settings.QUERY_BUDGET_RAISE:
+            raise QueryBudgetExceeded(
+                f'{request.method} {request.path}: ' + '; '.join(problems))
+        return response
@@ -0,0 +1,152 @@
+"""Кэш ответов списка и страницы рецепта для анонимных пользователей.
+
+В ключ страницы рецепта входят его id и версия, которая меняется при
+изменении рецепта, его продуктов или автора. Списки зависят от всех
+рецептов сразу, поэтому в их ключ входит общий номер версии, который
+увеличивается при любом таком изменении. В ответах абсолютные ссылки,
+поэтому в ключ входят и схема с хостом запроса. Сброс выполняется после
+фиксации транзакции, чтобы параллельный запрос не положил в кэш
+незавершённые данные.
+"""
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+
+from .conditional import normalize_params
+from .metrics import count_cache
+from recipes.models import FoodgramUser, Recipe, RecipeIngredient
+
+CACHE_ALIAS = 'recipes'
+LIST_VERSION_KEY = 'recipes:list_version'
+DETAIL_VERSION_KEY = 'recipes:detail_version:{}'
+HITS_KEY = 'recipes:hits'
+MISSES_KEY = 'recipes:misses'
+CACHE_STATUS_HEADER = 'X-Cache'
+AUTHOR_FIELDS = {'username', 'first_name', 'last_name', 'email', 'avatar'}
+
+
+class RecipeCache:
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def is_cacheable(request, pk=None):
+        return (
+            request.method == 'GET'
+            and not request.user.is_authenticated
+            and (pk is None or str(pk).isdigit())
+        )
+
+    def get_key(self, request, pk=None):
+        origin = f'{request.scheme}://{request.get_host()}'
+        if pk is not None:
+            pk = int(pk)
+            version = self.cache.get(DETAIL_VERSION_KEY.format(pk), 0)
+            return f'recipes:detail:{pk}:{version}:{origin}'
+        version = self.cache.get(LIST_VERSION_KEY, 0)
+        return f'recipes:list:{version}:{origin}:{normalize_params(request)}'
+
+    def lookup(self, key):
+        """Запись кэша (ETag, Last-Modified, данные) или None."""
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.count(HITS_KEY)
+        return entry
+
+    @staticmethod
+    def build_response(request, entry, render=Response):
+        """Ответ по записи кэша; render строит ответ из данных."""
+        etag, last_modified, data = entry
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified and parse_http_date_safe(
+                last_modified),
+        )
+        if response is None:
+            response = render(data)
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = last_modified
+        response[CACHE_STATUS_HEADER] = 'HIT'
+        return response
+
+    def respond(self, request, get_response, pk=None):
+        """Ответ из кэша или get_response() с сохранением данных в кэш.
+
+        Вместе с данными хранятся заголовки ETag и Last-Modified ответа,
+        так что при попадании в кэш условный запрос обходится без базы.
+        """
+        key = self.get_key(request, pk)
+        entry = self.lookup(key)
+        if entry is not None:
+            return self.build_response(request, entry)
+        self.count(MISSES_KEY)
+        response = get_response()
+        if response.status_code == 200:
+            self.cache.set(key, (
+                response.get('ETag'),
+                response.get('Last-Modified'),
+                response.data,
+            ))
+        response[CACHE_STATUS_HEADER] = 'MISS'
+        return response
+
+    def count(self, key):
+        count_cache('recipes', key == HITS_KEY)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 1, None)
+
+    def get_stats(self):
+        stats = self.cache.get_many((HITS_KEY, MISSES_KEY))
+        return {
+            'hits': stats.get(HITS_KEY, 0),
+            'misses': stats.get(MISSES_KEY, 0),
+        }
+
+    def invalidate(self, recipe_ids=()):
+        def invalidate():
+            self.cache.set_many({
+                DETAIL_VERSION_KEY.format(pk): uuid4().hex
+                for pk in recipe_ids
+            }, None)
+            try:
+                self.cache.incr(LIST_VERSION_KEY)
+            except ValueError:
+                self.cache.set(LIST_VERSION_KEY, 1, None)
+        transaction.on_commit(invalidate)
+
+
+recipe_cache = RecipeCache(CACHE_ALIAS)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe(instance, **kwargs):
+    recipe_cache.invalidate((instance.pk,))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def invalidate_recipe_ingredient(instance, **kwargs):
+    recipe_cache.invalidate((instance.recipe_id,))
+
+
+@receiver(post_save, sender=FoodgramUser)
+def invalidate_author(instance, created, update_fields, **kwargs):
+    if created or (update_fields and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    recipe_cache.invalidate(
+        list(instance.recipes.values_list('pk', flat=True)))
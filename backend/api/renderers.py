@@ -1,28 +1,136 @@
+import csv
 from datetime import datetime
+from io import BytesIO
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 
 INGREDIENT_ITEM = '{i}. {name} {amount} {measurement_unit}'
 RECIPE_ITEM = '{i}. {name}'
 LIST_HEADER = 'Список покупок {username} на {date}'
+CSV_HEADER = ('Продукт', 'Количество', 'Единица измерения')
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 18
 
 
 def render_shopping_list(ingredients, recipes, user):
-    return '\n'.join([
-        LIST_HEADER.format(
-            username=user.username,
-            date=datetime.now()
-        ),
-        'Продукты',
-        *(
-            INGREDIENT_ITEM.format(
-                i=i,
-                name=ingredient['ingredient__name'].capitalize(),
-                amount=ingredient['amount_total'],
-                measurement_unit=ingredient['ingredient__measurement_unit']
-            ) for i, ingredient in enumerate(ingredients, start=1)
-        ),
-        'Рецепты',
-        *(
-            RECIPE_ITEM.format(i=i, name=recipe)
-            for i, recipe in enumerate(recipes, start=1)
-        ),
-    ])
+    yield LIST_HEADER.format(
+        username=user.username,
+        date=datetime.now()
+    )
+    yield 'Продукты'
+    for i, ingredient in enumerate(ingredients, start=1):
+        yield INGREDIENT_ITEM.format(
+            i=i,
+            name=ingredient['ingredient__name'].capitalize(),
+            amount=ingredient['amount_total'],
+            measurement_unit=ingredient['ingredient__measurement_unit']
+        )
+    yield 'Рецепты'
+    for i, recipe in enumerate(recipes, start=1):
+        yield RECIPE_ITEM.format(i=i, name=recipe)
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый класс выгрузки списка покупок.
+
+    Сам список отдаёт метод stream(ingredients, recipes, user)
+    наследника, а render() нужен только для ответов с ошибками, которые
+    DRF формирует до вызова представления. Они отдаются в JSON. Если
+    streaming ложно, части собираются в один ответ целиком.
+    """
+
+    streaming = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data)
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients, recipes, user):
+        for line in render_shopping_list(ingredients, recipes, user):
+            yield f'{line}\n'
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+class CsvShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients, recipes, user):
+        writer = csv.writer(Echo())
+        yield writer.writerow(CSV_HEADER)
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient['ingredient__name'].capitalize(),
+                ingredient['amount_total'],
+                ingredient['ingredient__measurement_unit'],
+            ))
+
+
+class PdfShoppingListRenderer(ShoppingListRenderer):
+    """PDF собирается в памяти целиком: reportlab пишет документ только
+    при сохранении, поэтому потоком отдаются лишь txt и csv."""
+
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    streaming = False
+
+    def stream(self, ingredients, recipes, user):
+        if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT))
+        buffer = BytesIO()
+        canvas = Canvas(buffer, pagesize=A4)
+        _, height = A4
+        y = height - PDF_MARGIN
+        canvas.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+        for line in render_shopping_list(ingredients, recipes, user):
+            if y < PDF_MARGIN:
+                canvas.showPage()
+                canvas.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+                y = height - PDF_MARGIN
+            canvas.drawString(PDF_MARGIN, y, line)
+            y -= PDF_LINE_HEIGHT
+        canvas.save()
+        yield buffer.getvalue()
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CsvShoppingListRenderer,
+    PdfShoppingListRenderer,
+)
+
+
+class ShoppingListContentNegotiation(DefaultContentNegotiation):
+    """Формат выбирается параметром ?format=, по умолчанию — txt."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        if request.query_params.get(self.settings.URL_FORMAT_OVERRIDE):
+            return super().select_renderer(request, renderers, format_suffix)
+        return renderers[0], renderers[0].media_type
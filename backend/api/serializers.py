@@ -1,10 +1,15 @@
-from drf_extra_fields.fields import Base64ImageField
+from collections import Counter
+
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserSerializer
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from recipes.models import Recipe, RecipeIngredient, Ingredient
+from .images import Base64ImageUploadField, ImageVariantsField
+from recipes.models import (
+    Recipe, RecipeIngredient, Ingredient, ShoppingCartIngredient)
 
 User = get_user_model()
 
@@ -16,7 +21,7 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 
 class FoodgramUserSerializer(UserSerializer):
-    avatar = Base64ImageField(allow_null=True, required=False)
+    avatar = Base64ImageUploadField(allow_null=True, required=False)
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -32,13 +37,15 @@ class FoodgramUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, author):
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
         user = self.context.get('request').user
         return user.is_authenticated and author.authors.filter(
             user=user).exists()
 
 
 class UserAvatarSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField(required=True)
+    avatar = Base64ImageUploadField(required=True)
 
     class Meta:
         model = User
@@ -49,10 +56,40 @@ class UserAvatarSerializer(serializers.ModelSerializer):
             raise ValidationError('Необходимо передать изображение')
         return super().validate(data)
 
+    def update(self, user, validated_data):
+        user.avatar = validated_data['avatar']
+        user.save(update_fields=('avatar',))
+        return user
+
+
+class RecipeIngredientListSerializer(serializers.ListSerializer):
+    """Проверяет все продукты рецепта одним запросом к базе."""
+
+    def to_internal_value(self, data):
+        ingredients = super().to_internal_value(data)
+        ids = [ingredient['ingredient_id'] for ingredient in ingredients]
+        found = Ingredient.objects.in_bulk(ids)
+        errors = []
+        duplicate_ids = sorted(
+            pk for pk, count in Counter(ids).items() if count > 1)
+        if duplicate_ids:
+            errors.append(f'Ингредиенты повторяются: {duplicate_ids}')
+        missing_ids = sorted(set(ids) - found.keys())
+        if missing_ids:
+            errors.append(f'Ингредиенты не найдены: {missing_ids}')
+        if errors:
+            raise ValidationError(errors)
+        return [
+            {
+                'ingredient': found[ingredient['ingredient_id']],
+                'amount': ingredient['amount'],
+            }
+            for ingredient in ingredients
+        ]
+
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(), source='ingredient')
+    id = serializers.IntegerField(source='ingredient_id')
     name = serializers.CharField(source='ingredient.name', read_only=True)
     measurement_unit = serializers.CharField(
         source='ingredient.measurement_unit', read_only=True)
@@ -66,6 +103,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
             'measurement_unit',
             'amount',
         )
+        list_serializer_class = RecipeIngredientListSerializer
 
 
 class RecipeSerializer(serializers.ModelSerializer):
@@ -74,7 +112,8 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_in_shopping_cart = serializers.SerializerMethodField()
     ingredients = RecipeIngredientSerializer(
         source='recipe_ingredients', many=True, required=True)
-    image = Base64ImageField(required=True)
+    image = Base64ImageUploadField(required=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -86,6 +125,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time',
         )
@@ -93,18 +133,6 @@ class RecipeSerializer(serializers.ModelSerializer):
     def validate_ingredients(self, ingredients):
         if not ingredients:
             raise ValidationError('Необходимо указать хотя бы один ингредиент')
-        ingredient_ids = [
-            ingredient.get('ingredient')
-            for ingredient in ingredients]
-        dublicate_ids = [
-            ingredient_id for ingredient_id in set(ingredient_ids)
-            if ingredient_ids.count(ingredient_id) > 1
-        ]
-        if dublicate_ids:
-            raise ValidationError(
-                'Ингредиенты повторяются: '
-                f'{dublicate_ids}'
-            )
         return ingredients
 
     def validate_image(self, image):
@@ -112,18 +140,67 @@ class RecipeSerializer(serializers.ModelSerializer):
             raise ValidationError('Необходимо добавить изображение')
         return image
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('recipe_ingredients')
         recipe = super().create(validated_data)
         self.save_ingredients(recipe, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('recipe_ingredients')
-        instance.ingredients.clear()
-        self.save_ingredients(instance, ingredients)
+        # Блокировка рецепта упорядочивает параллельные правки: каждая
+        # считает разницу от состояния, записанного предыдущей.
+        Recipe.objects.select_for_update().filter(pk=instance.pk).values_list(
+            'pk').first()
+        changed_ingredients = self.update_ingredients(instance, ingredients)
+        # bulk_create и bulk_update не вызывают сигналов api.shopping_carts.
+        if changed_ingredients:
+            ShoppingCartIngredient.objects.refresh(
+                instance.shoppingcarts.values('user'), changed_ingredients)
         return super().update(instance, validated_data)
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients_data):
+        """Приводит продукты рецепта к ingredients_data минимумом записей.
+
+        Возвращает id продуктов, количество которых изменилось.
+        """
+        amounts = {
+            ingredient['ingredient'].pk: ingredient['amount']
+            for ingredient in ingredients_data
+        }
+        existing = {}
+        to_delete = []
+        to_update = []
+        for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=recipe):
+            ingredient_id = recipe_ingredient.ingredient_id
+            if ingredient_id not in amounts or ingredient_id in existing:
+                to_delete.append(recipe_ingredient)
+                continue
+            existing[ingredient_id] = recipe_ingredient
+            if recipe_ingredient.amount != amounts[ingredient_id]:
+                recipe_ingredient.amount = amounts[ingredient_id]
+                to_update.append(recipe_ingredient)
+        to_create = [
+            RecipeIngredient(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+        if to_delete:
+            RecipeIngredient.objects.filter(
+                pk__in=[row.pk for row in to_delete]).delete()
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ('amount',))
+        if to_create:
+            RecipeIngredient.objects.bulk_create(to_create)
+        return {
+            row.ingredient_id for row in (*to_delete, *to_update, *to_create)
+        }
+
     def save_ingredients(self, recipe, ingredients_data):
         RecipeIngredient.objects.bulk_create(
             RecipeIngredient(
@@ -134,35 +211,54 @@ class RecipeSerializer(serializers.ModelSerializer):
             for ingredient in ingredients_data
         )
 
+    def to_representation(self, recipe):
+        if hasattr(recipe, 'is_author_subscribed'):
+            recipe.author.is_subscribed = recipe.is_author_subscribed
+        # После создания или правки продукты ещё не выбраны из базы.
+        prefetch_related_objects([recipe], Prefetch(
+            'recipe_ingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        ))
+        return super().to_representation(recipe)
+
     def get_is_favorited(self, recipe):
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
         user = self.context.get('request').user
         return user.is_authenticated and recipe.favoriterecipes.filter(
             user=user).exists()
 
     def get_is_in_shopping_cart(self, recipe):
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
         user = self.context.get('request').user
         return user.is_authenticated and recipe.shoppingcarts.filter(
             user=user).exists()
 
 
 class RecipeResponseSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time',
         )
         read_only_fields = fields
 
 
+class RecipesLimitSerializer(serializers.Serializer):
+    recipes_limit = serializers.IntegerField(min_value=1, required=False)
+
+
 class UserRecipesSerializer(FoodgramUserSerializer):
-    recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(
-        source='recipes.count',
-        read_only=True,
-    )
+    recipes = RecipeResponseSerializer(
+        source='recipes_preview', many=True, read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -177,12 +273,3 @@ class UserRecipesSerializer(FoodgramUserSerializer):
             'recipes_count',
             'avatar',
         )
-
-    def get_recipes(self, user):
-        return RecipeResponseSerializer(
-            user.recipes.all()[:int(
-                self.context['request'].query_params.get(
-                    'recipes_limit', 10**10))],
-            many=True,
-            context=self.context
-        ).data
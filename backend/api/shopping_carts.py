@@ -0,0 +1,45 @@
+"""Суммы продуктов в корзинах покупок.
+
+Суммы пересчитываются при добавлении и удалении рецепта из корзины и
+при изменении продуктов рецепта, в том числе при каскадном удалении и
+правках в админке. Пересчёт выполняется после фиксации транзакции, когда
+каскадное удаление уже завершено. Записи, изменённые в обход сигналов
+(bulk_create, bulk_update), пересчитывает сам код, который их меняет, а
+расхождения находит и исправляет команда refresh_shopping_carts.
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import (
+    RecipeIngredient, ShoppingCart, ShoppingCartIngredient)
+
+
+def refresh_on_commit(users, ingredients=None):
+    transaction.on_commit(partial(
+        ShoppingCartIngredient.objects.refresh, users, ingredients))
+
+
+@receiver(post_save, sender=ShoppingCart)
+def refresh_added_cart(instance, created, **kwargs):
+    if created:
+        refresh_on_commit((instance.user_id,))
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def refresh_removed_cart(instance, **kwargs):
+    # Продукты рецепта к этому моменту могут быть уже удалены каскадом,
+    # поэтому корзина пользователя пересчитывается целиком.
+    refresh_on_commit((instance.user_id,))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def refresh_recipe_ingredient(instance, **kwargs):
+    refresh_on_commit(
+        ShoppingCart.objects.filter(
+            recipe_id=instance.recipe_id).values('user'),
+        (instance.ingredient_id,),
+    )
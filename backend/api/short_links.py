@@ -0,0 +1,131 @@
+"""Короткие ссылки на рецепты: /s/<код>/.
+
+Код — id рецепта в base62, младшими разрядами вперёд. Первый символ
+всегда буква, поэтому коды не пересекаются со старыми ссылками /s/<id>/.
+При SHORT_LINK_SIGNATURE_LENGTH > 0 к коду дописывается подпись HMAC
+такой длины, и коды чужих рецептов нельзя подобрать перебором; старые
+ссылки без подписи тогда работают, только если включён
+SHORT_LINK_LEGACY_IDS. Существование рецепта берётся из кэша, который
+обновляется при создании и удалении рецептов, так что переход по ссылке
+обычно обходится без базы данных. Отсутствие рецепта кэшируется лишь на
+SHORT_LINK_MISS_CACHE_TIMEOUT секунд, а его наличие — на
+SHORT_LINK_CACHE_TIMEOUT: столько остальные процессы могут вести на
+удалённый рецепт, если кэш SHORT_LINK_CACHE_ALIAS не общий.
+"""
+import string
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .metrics import count_cache
+from recipes.models import Recipe
+
+ALPHABET = string.digits + string.ascii_letters
+LETTERS = string.ascii_letters
+CACHE_KEY = 'short_link:recipe:{}'
+
+
+def to_base62(number):
+    digits = []
+    while number:
+        number, digit = divmod(number, len(ALPHABET))
+        digits.append(ALPHABET[digit])
+    return ''.join(digits)
+
+
+def sign(number):
+    digest = salted_hmac('short_link', str(number)).digest()
+    signature = to_base62(int.from_bytes(digest, 'big'))
+    return signature[:settings.SHORT_LINK_SIGNATURE_LENGTH]
+
+
+def encode(pk):
+    high, low = divmod(pk, len(LETTERS))
+    return LETTERS[low] + to_base62(high) + sign(pk)
+
+
+def decode(code):
+    """id рецепта по коду; ValueError, если код неверный или не подписан."""
+    length = settings.SHORT_LINK_SIGNATURE_LENGTH
+    body = code[:-length] if length else code
+    if not body or body[0] not in LETTERS:
+        raise ValueError(code)
+    number = 0
+    for char in reversed(body[1:]):
+        number = number * len(ALPHABET) + ALPHABET.index(char)
+    number = number * len(LETTERS) + LETTERS.index(body[0])
+    if not constant_time_compare(encode(number), code):
+        raise ValueError(code)
+    return number
+
+
+def allows_legacy_ids():
+    return (
+        not settings.SHORT_LINK_SIGNATURE_LENGTH
+        or settings.SHORT_LINK_LEGACY_IDS
+    )
+
+
+class ShortCodeConverter:
+    """Код короткой ссылки или старый числовой id рецепта."""
+
+    regex = '[0-9A-Za-z]+'
+
+    def to_python(self, value):
+        if value.isdigit() and allows_legacy_ids():
+            return int(value)
+        return decode(value)
+
+    def to_url(self, value):
+        return encode(int(value))
+
+
+def get_cache():
+    return caches[settings.SHORT_LINK_CACHE_ALIAS]
+
+
+def get_cached_existence(pk):
+    """True/False из кэша или None, если о рецепте ничего не известно."""
+    exists = get_cache().get(CACHE_KEY.format(pk))
+    count_cache('short_links', exists is not None)
+    return exists
+
+
+def set_existence(pk, exists):
+    get_cache().set(
+        CACHE_KEY.format(pk),
+        exists,
+        settings.SHORT_LINK_CACHE_TIMEOUT if exists
+        else settings.SHORT_LINK_MISS_CACHE_TIMEOUT,
+    )
+
+
+def forget_existence(pk):
+    get_cache().delete(CACHE_KEY.format(pk))
+
+
+def load_existence(pk):
+    exists = Recipe.objects.filter(pk=pk).exists()
+    set_existence(pk, exists)
+    return exists
+
+
+def recipe_exists(pk):
+    exists = get_cached_existence(pk)
+    return load_existence(pk) if exists is None else exists
+
+
+@receiver(post_save, sender=Recipe)
+def remember_recipe(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(partial(set_existence, instance.pk, True))
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_recipe(instance, **kwargs):
+    transaction.on_commit(partial(forget_existence, instance.pk))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class ProfilingTestRunner(DiscoverRunner):
+    """Запускает тесты с профилированием: эндпоинт, превысивший бюджет
+    запросов или повторяющий один запрос, валит тест. Ленты
+    раскладываются синхронно."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_PROFILING = True
+        settings.QUERY_BUDGET_RAISE = True
+        # Потоки раскладки не видят данных незафиксированной транзакции
+        # теста, поэтому в тестах ленты раскладываются синхронно.
+        settings.FEED_FANOUT_WORKERS = 0
@@ -0,0 +1,1745 @@
+import base64
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import Http404
+from django.test import AsyncClient, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from api import async_views
+from api import tokens
+from api.authentication import (
+    PROCESS_CACHE_BACKENDS, JWTAuthentication, check_denylist_cache,
+    token_cache, user_cache)
+from api.feed import fan_out_queue, rebuild_feeds
+from api import short_links
+from api.ingredient_index import ingredient_index
+from api.management.commands.load_ingredients import iter_json_array
+from api.metrics import REGISTRY
+from api.profiling import Profile, QueryBudgetExceeded, get_problems
+from api.recipe_cache import CACHE_ALIAS, recipe_cache
+from recipes.models import (
+    FavoriteRecipe, FeedEntry, Ingredient, Recipe, RecipeIngredient,
+    RecipeScore, ShoppingCart, ShoppingCartIngredient, Subscription)
+from recipes.views import get_recipe_async
+
+User = get_user_model()
+
+
+def get_async(path):
+    """GET через асинхронную цепочку промежуточных слоёв, как под ASGI."""
+    async def get():
+        return await AsyncClient().get(path)
+
+    return async_to_sync(get)()
+
+
+class RecipeListQueriesTest(APITestCase):
+    RECIPES_COUNT = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт {i}', measurement_unit='г')
+            for i in range(3)
+        ]
+        for i in range(cls.RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {i}', text='Текст',
+                image='recipe_images/test.png', cooking_time=10)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=1)
+                for ingredient in ingredients
+            )
+            FavoriteRecipe.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Subscription.objects.create(user=cls.user, author=cls.author)
+
+    def count_list_queries(self, limit):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        # Индекс продуктов для ETag строится один раз на процесс.
+        ingredient_index.get_digest()
+        for client_user in (None, self.user):
+            self.client.force_authenticate(client_user)
+            with self.subTest(user=client_user):
+                self.assertEqual(
+                    self.count_list_queries(1),
+                    self.count_list_queries(self.RECIPES_COUNT),
+                )
+
+    def test_viewer_flags(self):
+        self.client.force_authenticate(self.user)
+        recipe = self.client.get('/api/recipes/').data['results'][0]
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['is_in_shopping_cart'])
+        self.assertTrue(recipe['author']['is_subscribed'])
+        self.assertEqual(len(recipe['ingredients']), 3)
+
+
+class SubscriptionsQueriesTest(APITestCase):
+    AUTHORS_COUNT = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        for i in range(cls.AUTHORS_COUNT):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                password='pass')
+            for j in range(3):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {j}', text='Текст',
+                    image='recipe_images/test.png', cooking_time=10)
+            Subscription.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def count_subscriptions_queries(self, limit):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/users/subscriptions/',
+                {'limit': limit, 'recipes_limit': 2})
+        self.assertEqual(response.status_code, 200)
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 2)
+            self.assertEqual(author['recipes_count'], 3)
+            self.assertTrue(author['is_subscribed'])
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.assertEqual(
+            self.count_subscriptions_queries(1),
+            self.count_subscriptions_queries(self.AUTHORS_COUNT),
+        )
+
+    def test_invalid_recipes_limit(self):
+        for recipes_limit in ('0', '-1', 'abc'):
+            with self.subTest(recipes_limit=recipes_limit):
+                response = self.client.get(
+                    '/api/users/subscriptions/',
+                    {'recipes_limit': recipes_limit})
+                self.assertEqual(response.status_code, 400)
+
+
+class ShoppingListDownloadTest(APITestCase):
+    URL = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='pass')
+        ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+        for i in range(2):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {i}', text='Текст',
+                image='recipe_images/test.png', cooking_time=10)
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=100)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        ShoppingCartIngredient.objects.refresh()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def download(self, streaming=True, **params):
+        response = self.client.get(self.URL, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.streaming, streaming)
+        if not streaming:
+            return response, response.content
+        return response, b''.join(response.streaming_content)
+
+    def test_txt_is_default(self):
+        response, content = self.download()
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('1. Мука 200 г', content.decode())
+        self.assertIn('2. Рецепт', content.decode())
+
+    def test_csv(self):
+        response, content = self.download(format='csv')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertIn('Мука,200,г', content.decode())
+
+    def test_pdf(self):
+        response, content = self.download(streaming=False, format='pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    @override_settings(ASYNC_VIEWS=True)
+    def test_asgi_streaming(self):
+        token = Token.objects.create(user=self.user)
+
+        async def download():
+            response = await AsyncClient().get(
+                self.URL, authorization=f'Token {token.key}')
+            # Как ASGIHandler: ответ читается в цикле событий.
+            return response, b''.join(response.streaming_content)
+
+        response, content = async_to_sync(download)()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('1. Мука 200 г', content.decode())
+
+    def test_unknown_format(self):
+        response = self.client.get(self.URL, {'format': 'xls'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_error_is_json(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(self.URL, {'format': 'csv'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', json.loads(response.content))
+
+
+class ShoppingCartTotalsTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='pass')
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+        cls.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл')
+        cls.recipes = []
+        for i in range(2):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {i}', text='Текст',
+                image='recipe_images/test.png', cooking_time=10)
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.flour, amount=100)
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def totals(self, user=None):
+        return dict((user or self.user).shopping_cart_ingredients.values_list(
+            'ingredient', 'amount'))
+
+    def add_to_cart(self, recipe):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertEqual(response.status_code, 201)
+
+    def test_totals_follow_cart_and_recipe_changes(self):
+        for recipe in self.recipes:
+            self.add_to_cart(recipe)
+        self.assertEqual(self.totals(), {self.flour.pk: 200})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipes[0].pk}/',
+                {
+                    'ingredients': [
+                        {'id': self.flour.pk, 'amount': 50},
+                        {'id': self.milk.pk, 'amount': 300},
+                    ],
+                    'name': 'Новый рецепт',
+                    'text': 'Текст',
+                    'cooking_time': 5,
+                },
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.totals(), {self.flour.pk: 150, self.milk.pk: 300})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.totals(), {self.flour.pk: 100})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                f'/api/recipes/{self.recipes[1].pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.totals(), {})
+        call_command('refresh_shopping_carts', check=True, stdout=StringIO())
+
+    def test_totals_follow_changes_outside_views(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        recipe = Recipe.objects.create(
+            author=author, name='Чужой рецепт', text='Текст',
+            image='recipe_images/test.png', cooking_time=10)
+        recipe_ingredient = RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=self.milk, amount=10)
+        self.add_to_cart(recipe)
+        self.add_to_cart(self.recipes[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_ingredient.amount = 20
+            recipe_ingredient.save()
+        self.assertEqual(
+            self.totals(), {self.flour.pk: 100, self.milk.pk: 20})
+        with self.captureOnCommitCallbacks(execute=True):
+            author.delete()
+        self.assertEqual(self.totals(), {self.flour.pk: 100})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(ShoppingCartIngredient.objects.exists())
+
+    def test_check_reports_mismatches(self):
+        self.add_to_cart(self.recipes[0])
+        self.user.shopping_cart_ingredients.update(amount=1)
+        with self.assertRaises(CommandError):
+            call_command(
+                'refresh_shopping_carts', check=True,
+                stdout=StringIO(), stderr=StringIO())
+        call_command('refresh_shopping_carts', stdout=StringIO())
+        self.assertEqual(self.totals(), {self.flour.pk: 100})
+
+
+@override_settings(INGREDIENT_SEARCH_LIMIT=2)
+class IngredientSearchTest(APITestCase):
+    URL = '/api/ingredients/'
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Мука', 'мускат', 'малина', 'молоко', 'сахар'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        ingredient_index.invalidate()
+
+    def search(self, name=None):
+        response = self.client.get(self.URL, {'name': name} if name else {})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_prefix_search_is_case_insensitive_and_capped(self):
+        self.assertEqual(self.search('МУ'), ['Мука', 'мускат'])
+        self.assertEqual(self.search('м'), ['малина', 'молоко'])
+        self.assertEqual(self.search('хлеб'), [])
+        self.assertEqual(len(self.search()), 5)
+
+    def test_search_does_not_query_database(self):
+        self.search('му')
+        with self.assertNumQueries(0):
+            self.search('му')
+
+    def test_warm(self):
+        self.assertIsNone(ingredient_index.get_built_snapshot())
+        # Соединение теста закрывать нельзя: в нём идёт транзакция.
+        with mock.patch('api.ingredient_index.connections'):
+            ingredient_index.warm()
+        self.assertIsNotNone(ingredient_index.get_built_snapshot())
+        with self.assertNumQueries(0):
+            self.search('му')
+
+    def test_index_follows_ingredient_changes(self):
+        self.search('му')
+        Ingredient.objects.create(name='мусс', measurement_unit='г')
+        self.assertEqual(self.search('мус'), ['мускат', 'мусс'])
+        Ingredient.objects.get(name='мускат').delete()
+        self.assertEqual(self.search('мус'), ['мусс'])
+
+
+class NameSearchTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        for name in ('Борщ', 'Салат оливье', 'Оливки'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            Recipe.objects.create(
+                author=author, name=name, text='Текст',
+                image='recipe_images/test.png', cooking_time=10)
+
+    def search(self, url, query):
+        data = self.client.get(url, {'search': query}).json()
+        if isinstance(data, dict):
+            data = data['results']
+        return [item['name'] for item in data]
+
+    def test_substring_and_typo_search(self):
+        for url in ('/api/ingredients/', '/api/recipes/'):
+            with self.subTest(url=url):
+                self.assertCountEqual(
+                    self.search(url, 'олив'), ['Салат оливье', 'Оливки'])
+                self.assertEqual(self.search(url, 'борш'), ['Борщ'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужен EXPLAIN PostgreSQL')
+class QueryPlanTest(APITestCase):
+    """Основные запросы списков не должны сканировать большие таблицы."""
+
+    USERS_COUNT = 100
+    RECIPES_COUNT = 20000
+    INGREDIENTS_PER_RECIPE = 3
+    RELATIONS_PER_USER = 10
+    LARGE_TABLES = (
+        Recipe, RecipeIngredient, FavoriteRecipe, ShoppingCart, Subscription,
+        ShoppingCartIngredient, RecipeScore, FeedEntry,
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(0)
+        users = User.objects.bulk_create(
+            User(username=f'user{i}', email=f'user{i}@example.com')
+            for i in range(cls.USERS_COUNT)
+        )
+        cls.user = users[0]
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Продукт {i}', measurement_unit='г')
+            for i in range(100)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=random.choice(users), name=f'Рецепт {i}', text='Текст',
+                image='recipe_images/test.png', cooking_time=10)
+            for i in range(cls.RECIPES_COUNT)
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for recipe in recipes
+            for ingredient in random.sample(
+                ingredients, cls.INGREDIENTS_PER_RECIPE)
+        )
+        for model in (FavoriteRecipe, ShoppingCart):
+            model.objects.bulk_create(
+                model(user=user, recipe=recipe)
+                for user in users
+                for recipe in random.sample(recipes, cls.RELATIONS_PER_USER)
+            )
+        Subscription.objects.bulk_create(
+            Subscription(user=user, author=author)
+            for user in users
+            for author in random.sample(users, cls.RELATIONS_PER_USER)
+            if author != user
+        )
+        ShoppingCartIngredient.objects.refresh()
+        RecipeScore.objects.bulk_create(
+            RecipeScore(recipe=recipe, score=random.random())
+            for recipe in recipes
+        )
+        rebuild_feeds()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assert_no_seq_scans(self, url, params=None):
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        tables = [model._meta.db_table for model in self.LARGE_TABLES]
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT'):
+                    continue
+                if sql.startswith('SELECT COUNT(*)') and not params:
+                    # Подсчёт всех строк таблицы без фильтров — это её
+                    # полный просмотр при любых индексах.
+                    continue
+                cursor.execute(f'EXPLAIN ANALYZE {sql}')
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                for table in tables:
+                    self.assertNotIn(
+                        f'Seq Scan on {table}', plan, f'{sql}\n{plan}')
+
+    def test_recipe_list(self):
+        self.assert_no_seq_scans('/api/recipes/')
+
+    def test_recipe_list_by_author(self):
+        self.assert_no_seq_scans('/api/recipes/', {'author': self.user.pk})
+
+    def test_recipe_list_favorited(self):
+        self.assert_no_seq_scans('/api/recipes/', {'is_favorited': 1})
+
+    def test_recipe_list_in_shopping_cart(self):
+        self.assert_no_seq_scans('/api/recipes/', {'is_in_shopping_cart': 1})
+
+    def test_recipe_list_popular(self):
+        self.assert_no_seq_scans(
+            '/api/recipes/', {'ordering': 'popular', 'pagination': 'cursor'})
+
+    def test_subscriptions(self):
+        self.assert_no_seq_scans(
+            '/api/users/subscriptions/', {'recipes_limit': 3})
+
+    def test_feed(self):
+        self.assert_no_seq_scans(
+            '/api/recipes/feed/', {'pagination': 'cursor'})
+
+    def test_download_shopping_cart(self):
+        self.assert_no_seq_scans('/api/recipes/download_shopping_cart/')
+
+
+class CursorPaginationTest(APITestCase):
+    RECIPES_COUNT = 7
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        for i in range(cls.RECIPES_COUNT):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                password='pass')
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {i}', text='Текст',
+                image='recipe_images/test.png', cooking_time=10)
+            Subscription.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, params):
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(any(
+                query['sql'].startswith('SELECT COUNT(*)')
+                for query in queries.captured_queries
+            ))
+            ids.extend(item['id'] for item in response.data['results'])
+            url, params = response.data['next'], None
+        return ids
+
+    def test_recipes(self):
+        ids = self.walk('/api/recipes/', {'pagination': 'cursor', 'limit': 3})
+        self.assertEqual(
+            ids, list(Recipe.objects.values_list('id', flat=True)))
+
+    def test_subscriptions(self):
+        ids = self.walk(
+            '/api/users/subscriptions/',
+            {'pagination': 'cursor', 'limit': 2, 'recipes_limit': 1})
+        self.assertEqual(len(ids), self.RECIPES_COUNT)
+        self.assertEqual(len(set(ids)), self.RECIPES_COUNT)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Нужен EXPLAIN PostgreSQL')
+    def test_approximate_count_header(self):
+        response = self.client.get(
+            '/api/recipes/', {'pagination': 'cursor', 'count': 'approximate'})
+        self.assertIn('X-Approximate-Count', response)
+        response = self.client.get('/api/recipes/', {'pagination': 'cursor'})
+        self.assertNotIn('X-Approximate-Count', response)
+
+
+class RecipeCacheTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Текст',
+            image='recipe_images/test.png', cooking_time=10)
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=1)
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+
+    def get(self, url, params=None, cache_status='HIT'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], cache_status)
+        return response.data
+
+    def test_anonymous_responses_are_cached(self):
+        detail_url = f'/api/recipes/{self.recipe.pk}/'
+        for url in ('/api/recipes/', detail_url):
+            with self.subTest(url=url):
+                self.get(url, cache_status='MISS')
+                with self.assertNumQueries(0):
+                    self.get(url)
+        self.get('/api/recipes/', {'limit': 1, 'page': 1}, 'MISS')
+        self.get('/api/recipes/', {'page': 1, 'limit': 1})
+        self.assertEqual(recipe_cache.get_stats(), {'hits': 3, 'misses': 3})
+
+    def test_hosts_are_cached_separately(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/'):
+            with self.subTest(url=url):
+                self.get(url, cache_status='MISS')
+                response = self.client.get(
+                    url, HTTP_HOST='localhost', secure=True)
+                self.assertEqual(response['X-Cache'], 'MISS')
+                self.assertIn('https://localhost/', response.content.decode())
+
+    def test_authenticated_responses_are_not_cached(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.get('/api/recipes/')
+        self.assertNotIn('X-Cache', response)
+
+    def test_invalidation(self):
+        detail_url = f'/api/recipes/{self.recipe.pk}/'
+        changes = (
+            lambda: Recipe.objects.filter(pk=self.recipe.pk).get().save(),
+            lambda: RecipeIngredient.objects.create(
+                recipe=self.recipe, ingredient=self.ingredient, amount=2),
+            lambda: User.objects.get(pk=self.author.pk).save(),
+        )
+        for change in changes:
+            for url in ('/api/recipes/', detail_url):
+                self.client.get(url)
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            for url in ('/api/recipes/', detail_url):
+                self.get(url, cache_status='MISS')
+
+    def test_unrelated_user_update_keeps_cache(self):
+        self.get('/api/recipes/', cache_status='MISS')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save(update_fields=('last_login',))
+        self.get('/api/recipes/')
+
+
+class ConditionalGetTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Текст',
+            image='recipe_images/test.png', cooking_time=10)
+        Ingredient.objects.create(name='мука', measurement_unit='г')
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        self.detail_url = f'/api/recipes/{self.recipe.pk}/'
+
+    def get_etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_not_modified(self):
+        self.client.force_authenticate(self.user)
+        for url in (
+            '/api/recipes/', self.detail_url, '/api/ingredients/',
+            '/api/ingredients/?name=му', '/api/users/',
+            f'/api/users/{self.author.pk}/', '/api/users/me/',
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=self.get_etag(url))
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+
+    def test_etag_changes(self):
+        self.client.force_authenticate(self.user)
+        changes = (
+            lambda: Recipe.objects.get(pk=self.recipe.pk).save(),
+            lambda: FavoriteRecipe.objects.create(
+                user=self.user, recipe=self.recipe),
+            lambda: Ingredient.objects.create(
+                name='соль', measurement_unit='г'),
+        )
+        for change in changes:
+            etags = [
+                self.get_etag(url)
+                for url in ('/api/recipes/', self.detail_url)
+            ]
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+            for url, etag in zip(('/api/recipes/', self.detail_url), etags):
+                with self.subTest(change=change, url=url):
+                    self.assertNotEqual(self.get_etag(url), etag)
+
+    def test_favorite_toggle_with_cached_user(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        etag = self.get_etag(self.detail_url)
+        response = self.client.post(f'{self.detail_url}favorite/')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+    def test_author_profile_change(self):
+        updated_at = self.recipe.updated_at
+        etag = self.get_etag(self.detail_url)
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name = 'Новое имя'
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Last-Modified'],
+            http_date(User.objects.get(
+                pk=self.author.pk).profile_updated_at.timestamp()))
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipe.pk).updated_at, updated_at)
+
+    def test_etag_depends_on_viewer(self):
+        etag = self.get_etag(self.detail_url)
+        self.client.force_authenticate(self.user)
+        self.assertNotEqual(self.get_etag(self.detail_url), etag)
+
+    def test_last_modified_only_for_anonymous(self):
+        response = self.client.get(self.detail_url)
+        self.assertIn('Last-Modified', response)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.detail_url)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_cached_not_modified_without_queries(self):
+        for url in ('/api/recipes/', self.detail_url):
+            with self.subTest(url=url):
+                etag = self.get_etag(url)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['X-Cache'], 'HIT')
+        last_modified = self.client.get(self.detail_url)['Last-Modified']
+        response = self.client.get(
+            self.detail_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+
+def use_temp_media_root(test):
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root)
+    overrides = override_settings(
+        MEDIA_ROOT=media_root, IMAGE_PIPELINE_WORKERS=0)
+    overrides.enable()
+    test.addCleanup(overrides.disable)
+
+
+def make_base64_image(size, image_format='PNG', mode='RGBA', truncate=None):
+    output = BytesIO()
+    Image.new(mode, size, 'red').save(output, image_format)
+    return (f'data:image/{image_format.lower()};base64,'
+            + base64.b64encode(output.getvalue()[:truncate]).decode())
+
+
+class ImagePipelineTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+
+    def setUp(self):
+        use_temp_media_root(self)
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/recipes/', {
+                'name': 'Рецепт',
+                'text': 'Текст',
+                'cooking_time': 10,
+                'image': image,
+                'ingredients': [{'id': self.ingredient.pk, 'amount': 1}],
+            }, format='json')
+
+    def test_recipe_variants(self):
+        response = self.create_recipe(make_base64_image((2000, 1000)))
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        variants = self.client.get(
+            f'/api/recipes/{recipe.pk}/').data['image_variants']
+        sizes = {'full': (1280, 640), 'card': (480, 240), 'thumb': (150, 75)}
+        self.assertEqual(set(variants), set(sizes))
+        for variant, size in sizes.items():
+            for image_format in ('webp', 'jpeg'):
+                name = recipe.image_variants[variant][image_format]
+                self.assertTrue(variants[variant][image_format].endswith(
+                    default_storage.url(name)))
+                with default_storage.open(name) as file, \
+                        Image.open(file) as image:
+                    self.assertEqual(image.size, size)
+                    self.assertEqual(image.format, image_format.upper())
+
+    def test_invalid_image(self):
+        image = 'data:image/png;base64,' + base64.b64encode(
+            b'not an image').decode()
+        self.assertEqual(self.create_recipe(image).status_code, 400)
+
+    def test_broken_image_keeps_original(self):
+        with self.assertLogs('api.images', 'WARNING'):
+            response = self.create_recipe(
+                make_base64_image((100, 100), truncate=40))
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(self.client.get(
+            f'/api/recipes/{response.data["id"]}/').data['image_variants'])
+
+    def test_avatar_variants_are_replaced(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/api/users/me/avatar/', {
+                'avatar': make_base64_image((300, 300), 'JPEG', 'RGB')
+            }, format='json')
+        self.user.refresh_from_db()
+        thumb = self.user.avatar_variants['thumb']['jpeg']
+        self.assertTrue(default_storage.exists(thumb))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/api/users/me/avatar/')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_variants, {'source': ''})
+        call_command('collect_media', grace=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(thumb))
+
+    def test_avatar_delete_keeps_shared_file(self):
+        image = make_base64_image((20, 20))
+        other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass')
+        for user in (other, self.user):
+            self.client.force_authenticate(user)
+            response = self.client.put(
+                '/api/users/me/avatar/', {'avatar': image}, format='json')
+            self.assertEqual(response.status_code, 200)
+        other.refresh_from_db()
+        response = self.client.delete('/api/users/me/avatar/')
+        self.assertEqual(response.status_code, 204)
+        self.assertTrue(default_storage.exists(other.avatar.name))
+        call_command('collect_media', grace=0, stdout=StringIO())
+        self.assertTrue(default_storage.exists(other.avatar.name))
+
+    def test_save_rewrites_file_removed_after_check(self):
+        recipe = Recipe.objects.get(pk=self.create_recipe(
+            make_base64_image((20, 20))).data['id'])
+        name = recipe.image.name
+        with open(default_storage.path(name), 'rb') as file:
+            content = ContentFile(file.read(), name='image.png')
+
+        def remove_then_touch(path, *args):
+            os.remove(path)
+            os_utime(path, *args)
+
+        os_utime = os.utime
+        with mock.patch('recipes.storage.os.utime', remove_then_touch):
+            self.assertEqual(
+                default_storage.save('recipe_images/image.png', content),
+                name)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_identical_uploads_share_file(self):
+        image = make_base64_image((20, 20))
+        names = [
+            Recipe.objects.get(pk=self.create_recipe(image).data['id']).image
+            for _ in range(2)
+        ]
+        self.assertEqual(names[0], names[1])
+        self.assertRegex(names[0].name, r'^recipe_images/\w\w/\w{64}\.png$')
+
+    def test_collect_media(self):
+        recipe = Recipe.objects.get(pk=self.create_recipe(
+            make_base64_image((20, 20))).data['id'])
+        kept = Recipe.objects.get(pk=self.create_recipe(
+            make_base64_image((20, 20))).data['id'])
+        old_name = recipe.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/recipes/{recipe.pk}/', {
+                'image': make_base64_image((30, 30)),
+                'ingredients': [{'id': self.ingredient.pk, 'amount': 1}],
+            }, format='json')
+        call_command('collect_media', grace=0, stdout=StringIO())
+        self.assertTrue(default_storage.exists(old_name))
+        kept.delete()
+        call_command('collect_media', stdout=StringIO())
+        call_command(
+            'collect_media', grace=0, dry_run=True, stdout=StringIO())
+        self.assertTrue(default_storage.exists(old_name))
+        call_command('collect_media', grace=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(old_name))
+        recipe.refresh_from_db()
+        for name in (
+            recipe.image.name,
+            *recipe.image_variants['thumb'].values(),
+        ):
+            self.assertTrue(default_storage.exists(name))
+
+
+class LoadIngredientsTest(APITestCase):
+
+    def load(self, content, suffix, **options):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix=suffix, encoding='utf-8') as file:
+            file.write(content)
+            file.flush()
+            stdout = StringIO()
+            call_command(
+                'load_ingredients', file.name, stdout=stdout,
+                stderr=StringIO(), **options)
+        return stdout.getvalue()
+
+    def test_load_repository_data(self):
+        data = settings.BASE_DIR.parent / 'data'
+        output = StringIO()
+        call_command(
+            'load_ingredients', str(data / 'ingredients.csv'),
+            batch_size=500, stdout=output)
+        self.assertIn('Добавлено: 2186', output.getvalue())
+        output = StringIO()
+        call_command(
+            'load_ingredients', str(data / 'ingredients.json'), stdout=output)
+        self.assertIn('Добавлено: 0', output.getvalue())
+        self.assertIn('пропущено: 2186', output.getvalue())
+        self.assertEqual(Ingredient.objects.count(), 2186)
+        self.assertTrue(Ingredient.objects.filter(
+            name='ароматизатор "ананас"', measurement_unit='капля').exists())
+
+    def test_streaming_json(self):
+        items = [
+            {'name': f'продукт {i}', 'measurement_unit': 'г'}
+            for i in range(50)
+        ]
+        content = json.dumps(items, ensure_ascii=False, indent=2)
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.json', encoding='utf-8') as file:
+            file.write(content)
+            file.flush()
+            with open(file.name, encoding='utf-8') as stream:
+                self.assertEqual(
+                    list(iter_json_array(stream, chunk_size=7)), items)
+
+    def test_update_and_counts(self):
+        flour = Ingredient.objects.create(name='мука', measurement_unit='кг')
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        content = 'name,measurement_unit\nмука,г\nсоль,г\nсахар,г\n,г\n'
+        output = self.load(content, '.csv')
+        self.assertIn(
+            'Добавлено: 2, обновлено: 0, пропущено: 1, с ошибками: 1',
+            output)
+        Ingredient.objects.filter(name='мука', measurement_unit='г').delete()
+        output = self.load(content, '.csv', update=True)
+        self.assertIn(
+            'Добавлено: 0, обновлено: 1, пропущено: 2, с ошибками: 1',
+            output)
+        flour.refresh_from_db()
+        self.assertEqual(flour.measurement_unit, 'г')
+
+    def test_invalid_file(self):
+        with self.assertRaises(CommandError):
+            self.load('{"name": "мука"}', '.json')
+        with self.assertRaises(CommandError):
+            self.load('[{"name": "мука"', '.json')
+
+
+class RecipeUpdateTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт {i}', measurement_unit='г')
+            for i in range(4)
+        ]
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Текст',
+            image='recipe_images/test.png', cooking_time=10)
+        for ingredient in cls.ingredients[:3]:
+            RecipeIngredient.objects.create(
+                recipe=cls.recipe, ingredient=ingredient, amount=1)
+
+    def setUp(self):
+        use_temp_media_root(self)
+
+    def test_only_changed_rows_are_written(self):
+        kept, changed, removed, added = self.ingredients
+        kept_row = RecipeIngredient.objects.get(ingredient=kept)
+        self.client.force_authenticate(self.author)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/', {
+                    'ingredients': [
+                        {'id': kept.pk, 'amount': 1},
+                        {'id': changed.pk, 'amount': 5},
+                        {'id': added.pk, 'amount': 2},
+                    ],
+                }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {(row['id'], row['amount'])
+             for row in response.data['ingredients']},
+            {(kept.pk, 1), (changed.pk, 5), (added.pk, 2)},
+        )
+        self.assertTrue(RecipeIngredient.objects.filter(
+            pk=kept_row.pk, amount=1).exists())
+        self.assertFalse(RecipeIngredient.objects.filter(
+            ingredient=removed).exists())
+        sql = [query['sql'] for query in queries]
+        self.assertTrue(any(
+            'FOR UPDATE' in query and '"recipes_recipe"' in query
+            for query in sql))
+        self.assertEqual(
+            sum(query.startswith('DELETE FROM "recipes_recipeingredient"')
+                for query in sql), 1)
+
+    def test_ingredient_errors_are_reported_together(self):
+        self.client.force_authenticate(self.author)
+        kept = self.ingredients[0]
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/', {
+                'ingredients': [
+                    {'id': kept.pk, 'amount': 1},
+                    {'id': kept.pk, 'amount': 2},
+                    {'id': 0, 'amount': 1},
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['ingredients'], [
+            f'Ингредиенты повторяются: [{kept.pk}]',
+            'Ингредиенты не найдены: [0]',
+        ])
+
+    def test_query_count_does_not_depend_on_ingredients(self):
+        self.client.force_authenticate(self.author)
+
+        def count_queries(ingredients):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/recipes/', {
+                    'name': 'Рецепт',
+                    'text': 'Текст',
+                    'cooking_time': 10,
+                    'image': make_base64_image((10, 10)),
+                    'ingredients': [
+                        {'id': ingredient.pk, 'amount': 1}
+                        for ingredient in ingredients
+                    ],
+                }, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(
+                len(response.data['ingredients']), len(ingredients))
+            return len(queries)
+
+        self.assertEqual(
+            count_queries(self.ingredients[:1]),
+            count_queries(self.ingredients),
+        )
+
+
+class CountersTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Текст',
+            image='recipe_images/test.png', cooking_time=10)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def assertCounters(self, instance, **counters):
+        instance.refresh_from_db()
+        self.assertEqual(
+            {counter: getattr(instance, counter) for counter in counters},
+            counters)
+
+    def test_relations_change_counters(self):
+        recipe_url = f'/api/recipes/{self.recipe.pk}'
+        stale_recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.client.post(f'{recipe_url}/favorite/')
+        self.client.post(f'{recipe_url}/shopping_cart/')
+        response = self.client.post(
+            f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(response.data['recipes_count'], 1)
+        self.assertCounters(
+            self.recipe, favorites_count=1, shopping_carts_count=1)
+        self.assertCounters(
+            self.author, recipes_count=1, subscribers_count=1)
+        self.assertCounters(self.user, subscriptions_count=1)
+        # Сохранение устаревшего объекта не сбрасывает счётчики.
+        stale_recipe.save()
+        self.assertCounters(self.recipe, favorites_count=1)
+        self.client.delete(f'{recipe_url}/favorite/')
+        self.assertCounters(self.recipe, favorites_count=0)
+
+    def test_cascade_delete(self):
+        Subscription.objects.create(user=self.user, author=self.author)
+        FavoriteRecipe.objects.create(user=self.author, recipe=self.recipe)
+        self.user.delete()
+        self.assertCounters(self.author, subscribers_count=0)
+        self.recipe.delete()
+        self.assertCounters(self.author, recipes_count=0)
+
+    def test_refresh_counters(self):
+        Recipe.objects.update(favorites_count=5)
+        User.objects.filter(pk=self.author.pk).update(recipes_count=0)
+        with self.assertRaises(CommandError):
+            call_command(
+                'refresh_counters', check=True, stderr=StringIO())
+        call_command('refresh_counters', stdout=StringIO())
+        call_command('refresh_counters', check=True, stdout=StringIO())
+        self.assertCounters(self.recipe, favorites_count=0)
+        self.assertCounters(self.author, recipes_count=1)
+
+
+class PopularityTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com',
+                password='pass')
+            for i in range(3)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.users[0], name=f'Рецепт {i}', text='Текст',
+                image='recipe_images/test.png', cooking_time=10)
+            for i in range(3)
+        ]
+
+    def get_popular(self, **params):
+        response = self.client.get(
+            '/api/recipes/', {'ordering': 'popular', **params})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def get_scores(self):
+        return dict(RecipeScore.objects.values_list('recipe', 'score'))
+
+    def test_relations_change_order(self):
+        first, second, third = self.recipes
+        self.client.force_authenticate(self.users[1])
+        self.client.post(f'/api/recipes/{second.pk}/favorite/')
+        self.client.post(f'/api/recipes/{third.pk}/shopping_cart/')
+        expected = [third.pk, second.pk, first.pk]
+        self.assertEqual(self.get_popular(), expected)
+        self.assertEqual(
+            self.get_popular(pagination='cursor', limit=2), expected[:2])
+        self.client.delete(f'/api/recipes/{third.pk}/shopping_cart/')
+        self.assertAlmostEqual(self.get_scores()[third.pk], 0)
+        self.assertEqual(self.get_popular()[0], second.pk)
+
+    def test_old_relations_decay(self):
+        first, second, _ = self.recipes
+        for user in self.users:
+            FavoriteRecipe.objects.create(user=user, recipe=first)
+        FavoriteRecipe.objects.filter(recipe=first).update(
+            created_at=timezone.now() - timedelta(days=30))
+        FavoriteRecipe.objects.create(user=self.users[0], recipe=second)
+        call_command('refresh_popularity', stdout=StringIO())
+        self.assertEqual(self.get_popular()[:2], [second.pk, first.pk])
+
+    def test_migration_scores_existing_relations(self):
+        create_scores = import_module(
+            'recipes.migrations.0020_recipe_score').create_scores
+        for user, recipe in zip(self.users, self.recipes):
+            FavoriteRecipe.objects.create(user=user, recipe=recipe)
+            ShoppingCart.objects.create(user=user, recipe=self.recipes[0])
+        expected = self.get_scores()
+        RecipeScore.objects.all().delete()
+        with connection.schema_editor() as schema_editor:
+            create_scores(apps, schema_editor)
+        scores = self.get_scores()
+        self.assertEqual(scores.keys(), expected.keys())
+        for pk, score in expected.items():
+            self.assertAlmostEqual(scores[pk] / score, 1)
+
+    def test_refresh_matches_incremental_scores(self):
+        for user, recipe in zip(self.users, self.recipes):
+            FavoriteRecipe.objects.create(user=user, recipe=recipe)
+            ShoppingCart.objects.create(user=user, recipe=self.recipes[0])
+        incremental = self.get_scores()
+        RecipeScore.objects.all().delete()
+        call_command('refresh_popularity', stdout=StringIO())
+        refreshed = self.get_scores()
+        self.assertEqual(refreshed.keys(), incremental.keys())
+        for pk, score in incremental.items():
+            self.assertAlmostEqual(refreshed[pk] / score, 1)
+
+
+class FeedTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                password='pass')
+            for i in range(2)
+        ]
+        Subscription.objects.create(user=cls.reader, author=cls.authors[0])
+
+    def setUp(self):
+        self.client.force_authenticate(self.reader)
+
+    def create_recipe(self, author, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                author=author, name=name, text='Текст',
+                image='recipe_images/test.png', cooking_time=10)
+
+    def get_feed(self, **params):
+        ids = []
+        url = '/api/recipes/feed/'
+        params = {'pagination': 'cursor', 'limit': 2, **params}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url, params = response.data['next'], None
+        return ids
+
+    def test_new_recipes_reach_followers(self):
+        followed, other = self.authors
+        recipes = [self.create_recipe(followed, f'Рецепт {i}')
+                   for i in range(3)]
+        self.create_recipe(other, 'Чужой рецепт')
+        self.assertEqual(
+            self.get_feed(), [recipe.pk for recipe in reversed(recipes)])
+        self.client.force_authenticate(other)
+        self.assertEqual(self.get_feed(), [])
+
+    def test_subscriptions_change_feed(self):
+        _, other = self.authors
+        recipe = self.create_recipe(other, 'Рецепт')
+        response = self.client.post(f'/api/users/{other.pk}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_feed(), [recipe.pk])
+        self.client.delete(f'/api/users/{other.pk}/subscribe/')
+        self.assertEqual(self.get_feed(), [])
+        self.assertFalse(FeedEntry.objects.exists())
+
+    @override_settings(FEED_FANOUT_WORKERS=1)
+    def test_fan_out_runs_in_background(self):
+        followed, _ = self.authors
+        with mock.patch.object(fan_out_queue, 'get_threads') as get_threads:
+            recipe = self.create_recipe(followed, 'Рецепт')
+        self.assertFalse(FeedEntry.objects.exists())
+        get_threads.return_value.submit.assert_called_once_with(
+            fan_out_queue.run_in_thread,
+            recipe.pk, followed.pk, recipe.created_at,
+        )
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_popular_authors_are_read_on_request(self):
+        followed, _ = self.authors
+        recipes = [self.create_recipe(followed, f'Рецепт {i}')
+                   for i in range(3)]
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(
+            self.get_feed(), [recipe.pk for recipe in reversed(recipes)])
+
+    def test_anonymous(self):
+        self.client.force_authenticate(None)
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 401)
+
+
+class AsyncViewsTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Текст',
+            image='recipe_images/test.png', cooking_time=10)
+        Ingredient.objects.create(name='мука', measurement_unit='г')
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        self.factory = RequestFactory()
+
+    def test_cached_recipes_without_database(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        expected = self.client.get(url)
+        self.assertEqual(expected['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            request = self.factory.get(url)
+            response = async_to_sync(async_views.recipe_detail)(
+                request, pk=self.recipe.pk)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(json.loads(response.content), expected.data)
+        request = self.factory.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        response = async_to_sync(async_views.recipe_detail)(
+            request, pk=self.recipe.pk)
+        self.assertEqual(response.status_code, 304)
+
+    def test_other_requests_use_rest_framework(self):
+        self.client.get('/api/recipes/')
+        request = self.factory.get(
+            '/api/recipes/', HTTP_AUTHORIZATION='Token invalid')
+        response = async_to_sync(async_views.recipe_list)(request)
+        self.assertEqual(response.status_code, 401)
+        request = self.factory.post('/api/recipes/', {})
+        response = async_to_sync(async_views.recipe_list)(request)
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(async_views.recipe_list.csrf_exempt)
+
+    def test_ingredients_without_database(self):
+        expected = self.client.get('/api/ingredients/', {'name': 'му'})
+        with self.assertNumQueries(0):
+            request = self.factory.get('/api/ingredients/', {'name': 'му'})
+            response = async_to_sync(async_views.ingredient_list)(request)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+
+    def test_short_link(self):
+        request = self.factory.get(f'/s/{self.recipe.pk}/')
+        response = async_to_sync(get_recipe_async)(
+            request, recipe_id=self.recipe.pk)
+        self.assertEqual(response.status_code, 302)
+        with self.assertRaises(Http404):
+            async_to_sync(get_recipe_async)(request, recipe_id=0)
+
+
+class ShortLinkTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe = Recipe.objects.create(
+                author=self.author, name='Рецепт', text='Текст',
+                image='recipe_images/test.png', cooking_time=10)
+
+    def test_codes(self):
+        for pk in (*range(200), 10 ** 6, 2 ** 63 - 1):
+            code = short_links.encode(pk)
+            self.assertIn(code[0], short_links.LETTERS)
+            self.assertEqual(short_links.decode(code), pk)
+        self.assertLessEqual(len(short_links.encode(10 ** 6)), 4)
+        for code in ('a0', '1a', '', 'a-'):
+            with self.assertRaises(ValueError):
+                short_links.decode(code)
+
+    @override_settings(SHORT_LINK_SIGNATURE_LENGTH=3)
+    def test_signed_codes(self):
+        code = short_links.encode(12345)
+        self.assertEqual(short_links.decode(code), 12345)
+        tampered = short_links.encode(12346)[:-3] + code[-3:]
+        with self.assertRaises(ValueError):
+            short_links.decode(tampered)
+
+    def test_redirect_without_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                f'/api/recipes/{self.recipe.pk}/get-link/')
+        link = response.data['short-link']
+        self.assertTrue(link.endswith(
+            f'/s/{short_links.encode(self.recipe.pk)}/'))
+        for url in (link, f'/s/{self.recipe.pk}/'):
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.url, f'/recipes/{self.recipe.pk}')
+
+    @override_settings(SHORT_LINK_SIGNATURE_LENGTH=3)
+    def test_legacy_ids_with_signatures(self):
+        url = f'/s/{self.recipe.pk}/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with override_settings(SHORT_LINK_LEGACY_IDS=True):
+            self.assertEqual(self.client.get(url).status_code, 302)
+
+    @override_settings(SHORT_LINK_CACHE_TIMEOUT=0)
+    def test_existence_expires(self):
+        # Так рецепт, удалённый в другом процессе, перестаёт открываться.
+        cache.clear()
+        url = f'/s/{short_links.encode(self.recipe.pk)}/'
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_missing_recipes(self):
+        url = f'/s/{short_links.encode(self.recipe.pk)}/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+            self.assertEqual(self.client.get('/s/a0/').status_code, 404)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/s/999999/').status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/s/999999/').status_code, 404)
+        with self.settings(SHORT_LINK_MISS_CACHE_TIMEOUT=0):
+            with self.assertNumQueries(2):
+                for _ in range(2):
+                    self.assertEqual(
+                        self.client.get('/s/999998/').status_code, 404)
+
+
+@override_settings(QUERY_PROFILING=True, QUERY_BUDGET_RAISE=False)
+class QueryProfilingTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        for i in range(3):
+            Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {i}', text='Текст',
+                image='recipe_images/test.png', cooking_time=10)
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+
+    def test_server_timing(self):
+        with self.assertLogs('api.profiling', 'INFO') as logs:
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(
+            re.findall(r'([\w-]+);dur=', response['Server-Timing']),
+            ['db', 'serialize', 'total'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['path'], '/api/recipes/')
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(record['problems'], [])
+
+    def test_async_server_timing(self):
+        with self.assertLogs('api.profiling', 'INFO') as logs:
+            response = get_async(
+                f'/api/recipes/{Recipe.objects.first().pk}/')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertGreater(record['queries'], 0)
+
+    @override_settings(QUERY_BUDGET=1)
+    def test_budget(self):
+        with self.assertLogs('api.profiling', 'WARNING'):
+            self.client.get('/api/recipes/')
+        with override_settings(QUERY_BUDGET_RAISE=True):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/api/recipes/', {'limit': 2})
+
+    def test_duplicates(self):
+        profile = Profile()
+        with connection.execute_wrapper(profile):
+            for recipe in Recipe.objects.all():
+                User.objects.get(pk=recipe.author_id)
+            list(Recipe.objects.filter(pk__in=(1, 2)))
+            list(Recipe.objects.filter(pk__in=(1, 2, 3)))
+        self.assertEqual(profile.queries, 6)
+        self.assertEqual(list(profile.get_duplicates().values()), [3, 2])
+        with override_settings(QUERY_DUPLICATES_LIMIT=2):
+            self.assertEqual(len(get_problems(profile)), 1)
+
+
+class MetricsTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Текст',
+            image='recipe_images/test.png', cooking_time=10)
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+
+    def get_value(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_metrics(self):
+        labels = {'view': 'api:recipe-detail'}
+        requests = self.get_value(
+            'foodgram_request_duration_seconds_count',
+            method='GET', status='200', **labels)
+        queries = self.get_value('foodgram_db_queries_total', **labels)
+        self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(self.get_value(
+            'foodgram_request_duration_seconds_count',
+            method='GET', status='200', **labels), requests + 1)
+        self.assertGreater(
+            self.get_value('foodgram_db_queries_total', **labels), queries)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            b'foodgram_request_duration_seconds_bucket', response.content)
+
+    def test_async_request_metrics(self):
+        labels = {'view': 'api:recipe-detail'}
+        queries = self.get_value('foodgram_db_queries_total', **labels)
+        response = get_async(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(
+            self.get_value('foodgram_db_queries_total', **labels), queries)
+
+    def test_metrics_from_outside(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, 404)
+        with self.settings(METRICS_ALLOWED_NETWORKS=['203.0.113.0/24']):
+            response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cache_metrics(self):
+        def get_counts():
+            return [
+                self.get_value(
+                    'foodgram_cache_requests_total',
+                    cache='recipes', result=result)
+                for result in ('hit', 'miss')
+            ]
+
+        hits, misses = get_counts()
+        for _ in range(2):
+            self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(get_counts(), [hits + 1, misses + 1])
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        name = 'foodgram_request_duration_seconds_count'
+        labels = {
+            'view': 'api:recipe-list', 'method': 'GET', 'status': '200'}
+        count = self.get_value(name, **labels)
+        self.client.get('/api/recipes/')
+        self.assertEqual(self.get_value(name, **labels), count)
+
+
+class TokenCacheTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass')
+
+    def setUp(self):
+        token_cache.clear()
+        response = self.client.post(
+            '/api/auth/token/login/',
+            {'email': 'user@example.com', 'password': 'pass'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/me/')
+        return response.status_code, [
+            query['sql'] for query in queries
+            if 'authtoken_token' in query['sql']
+        ]
+
+    def test_cached_lookup(self):
+        status_code, lookups = self.get_me()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(self.get_me(), (200, []))
+
+    def test_logout(self):
+        self.get_me()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_me()[0], 401)
+
+    def test_deactivation(self):
+        self.get_me()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_me()[0], 401)
+
+    def test_last_login_keeps_cache(self):
+        self.get_me()
+        with CaptureQueriesContext(connection) as queries:
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=('last_login',))
+        self.assertFalse(any(
+            'authtoken_token' in query['sql'] for query in queries))
+        self.assertEqual(self.get_me(), (200, []))
+
+    def test_writes_use_fresh_user(self):
+        self.get_me()
+        # Изменения в другом воркере не сбрасывают кэш этого процесса.
+        users = User.objects.filter(pk=self.user.pk)
+        users.update(first_name='Новое имя')
+        response = self.client.delete('/api/users/me/avatar/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(users.get().first_name, 'Новое имя')
+        self.get_me()
+        users.update(is_active=False)
+        self.assertEqual(self.get_me(), (200, []))
+        response = self.client.delete('/api/users/me/avatar/')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(users.get().is_active)
+
+    @override_settings(TOKEN_CACHE_SIZE=0, TOKEN_CACHE_ALIAS='default')
+    def test_shared_cache(self):
+        self.get_me()
+        self.assertEqual(self.get_me(), (200, []))
+        self.assertEqual(len(token_cache.entries), 0)
+        self.client.post('/api/auth/token/logout/')
+        self.assertEqual(self.get_me()[0], 401)
+
+    @override_settings(TOKEN_CACHE_SIZE=1)
+    def test_size_limit(self):
+        self.get_me()
+        token_cache.set('other', b'')
+        self.assertEqual(len(token_cache.entries), 1)
+        self.assertEqual(len(self.get_me()[1]), 1)
+
+
+@override_settings(AUTH_MODE='jwt', JWT_DENYLIST_CACHE='default')
+class JWTTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass')
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.factory = APIRequestFactory()
+        response = self.post(
+            tokens.TokenObtainPairView,
+            {'email': 'user@example.com', 'password': 'pass'})
+        self.access = response.data['access']
+        self.refresh = response.data['refresh']
+
+    def post(self, view, data, **extra):
+        request = self.factory.post('/', data, format='json', **extra)
+        return view.as_view()(request)
+
+    def authenticate(self, access=None):
+        request = self.factory.get(
+            '/', HTTP_AUTHORIZATION=f'Bearer {access or self.access}')
+        return JWTAuthentication().authenticate(Request(request))
+
+    def test_access_without_database(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual(user, self.user)
+
+    def test_refresh_rotation(self):
+        response = self.post(
+            tokens.TokenRefreshView, {'refresh': self.refresh})
+        self.assertEqual(response.status_code, 200)
+        self.authenticate(response.data['access'])
+        response = self.post(
+            tokens.TokenRefreshView, {'refresh': self.refresh})
+        self.assertEqual(response.status_code, 401)
+
+    def test_logout(self):
+        response = self.post(
+            tokens.TokenDenyView, {'refresh': self.refresh},
+            HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        self.assertEqual(response.status_code, 204)
+        with self.assertRaises(InvalidToken):
+            self.authenticate()
+        response = self.post(
+            tokens.TokenRefreshView, {'refresh': self.refresh})
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(JWT_DENYLIST_CACHE='jwt_denylist')
+    def test_process_cache_refused(self):
+        check_denylist_cache()
+        for backend in PROCESS_CACHE_BACKENDS:
+            caches_setting = {
+                **settings.CACHES, 'jwt_denylist': {'BACKEND': backend}}
+            with self.subTest(backend=backend):
+                with self.settings(CACHES=caches_setting):
+                    with self.assertRaises(ImproperlyConfigured):
+                        check_denylist_cache()
+        with self.settings(JWT_DENYLIST_CACHE='missing'):
+            with self.assertRaises(ImproperlyConfigured):
+                check_denylist_cache()
+
+    def test_password_change(self):
+        self.authenticate()
+        self.user.set_password('new')
+        self.user.save()
+        with self.assertRaises(InvalidToken):
+            self.authenticate()
+        response = self.post(tokens.TokenVerifyView, {'token': self.access})
+        self.assertEqual(response.status_code, 401)
+        access = self.post(
+            tokens.TokenObtainPairView,
+            {'email': 'user@example.com', 'password': 'new'},
+        ).data['access']
+        self.assertEqual(self.authenticate(access)[0], self.user)
+
+
+class SeedDataTest(APITestCase):
+
+    def seed(self, **options):
+        call_command(
+            'seed_data', users=5, recipes=20, favorites=3, carts=2,
+            subscriptions=2, stdout=StringIO(), **options)
+        return list(Recipe.objects.order_by('pk').values_list(
+            'author__username', 'name', 'favorites_count'))
+
+    def test_seed_is_reproducible(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Продукт {i}', measurement_unit='г')
+            for i in range(20)
+        )
+        recipes = self.seed()
+        self.assertEqual(len(recipes), 20)
+        with self.assertRaises(CommandError):
+            self.seed()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.seed(clear=True), recipes)
+        updates = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE')
+        ]
+        # Очистка не запускает сигналы: счётчики, ленты и рейтинги
+        # не обновляются по каждой удалённой записи.
+        self.assertLess(len(updates), 10)
+        call_command('refresh_counters', check=True, stdout=StringIO())
+        call_command('refresh_shopping_carts', check=True, stdout=StringIO())
+        output = StringIO()
+        call_command(
+            'benchmark_api', 'recipes', 'recipe_create', repeat=2, warmup=0,
+            stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 2)
+        self.assertEqual(Recipe.objects.count(), 20)
@@ -0,0 +1,89 @@
+"""Адреса auth/jwt/ для входа по JWT (AUTH_MODE=jwt).
+
+Токены проверяет api.authentication.JWTAuthentication. Refresh-токены
+одноразовые: при обновлении и выходе они попадают в список отозванных.
+"""
+from time import time
+
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from rest_framework import serializers, status
+from rest_framework.response import Response
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt import views as jwt_views
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import (
+    AccessToken, RefreshToken, UntypedToken)
+
+from .authentication import (
+    JWTAuthentication, check_token, deny, revoke_user)
+from recipes.models import FoodgramUser
+
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Время выдачи переходит в access-токены и в refresh-токены после
+        # ротации, по нему отзываются все токены пользователя.
+        token['iat'] = time()
+        return token
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        check_token(refresh)
+        if api_settings.ROTATE_REFRESH_TOKENS and not deny(refresh):
+            raise TokenError('Токен отозван')
+        return super().validate(attrs)
+
+
+class TokenVerifySerializer(jwt_serializers.TokenVerifySerializer):
+    def validate(self, attrs):
+        check_token(UntypedToken(attrs['token']))
+        return {}
+
+
+class TokenDenySerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+    def validate(self, attrs):
+        deny(RefreshToken(attrs['refresh']))
+        return {}
+
+
+class TokenObtainPairView(jwt_views.TokenObtainPairView):
+    serializer_class = TokenObtainPairSerializer
+
+
+class TokenRefreshView(jwt_views.TokenRefreshView):
+    serializer_class = TokenRefreshSerializer
+
+
+class TokenVerifyView(jwt_views.TokenVerifyView):
+    serializer_class = TokenVerifySerializer
+
+
+class TokenDenyView(jwt_views.TokenViewBase):
+    """Выход: отзывает refresh-токен и access-токен запроса."""
+
+    authentication_classes = (JWTAuthentication,)
+    serializer_class = TokenDenySerializer
+
+    def post(self, request, *args, **kwargs):
+        super().post(request, *args, **kwargs)
+        if isinstance(request.auth, AccessToken):
+            deny(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@receiver(post_save, sender=FoodgramUser)
+def revoke_user_tokens(instance, created, **kwargs):
+    # set_password() хранит новый пароль в _password до конца save().
+    if created or settings.AUTH_MODE != 'jwt':
+        return
+    if not instance.is_active or instance._password is not None:
+        revoke_user(instance.pk)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
@@ -13,5 +14,33 @@ router.register('recipes', RecipeViewSet)
 
 urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
+]
+
+if settings.ASYNC_VIEWS:
+    from . import async_views
+
+    urlpatterns += [
+        path('ingredients/', async_views.ingredient_list,
+             name='ingredients-list'),
+        path('recipes/', async_views.recipe_list, name='recipes-list'),
+        path('recipes/<int:pk>/', async_views.recipe_detail,
+             name='recipes-detail'),
+    ]
+
+if settings.AUTH_MODE == 'jwt':
+    from . import tokens
+
+    urlpatterns += [
+        path('auth/jwt/create/', tokens.TokenObtainPairView.as_view(),
+             name='jwt-create'),
+        path('auth/jwt/refresh/', tokens.TokenRefreshView.as_view(),
+             name='jwt-refresh'),
+        path('auth/jwt/verify/', tokens.TokenVerifyView.as_view(),
+             name='jwt-verify'),
+        path('auth/jwt/logout/', tokens.TokenDenyView.as_view(),
+             name='jwt-logout'),
+    ]
+
+urlpatterns += [
     path('', include(router.urls)),
 ]
@@ -1,21 +1,36 @@
-from django.db.models import Sum
+from functools import partial
+
+from django.db import transaction
+from django.db.models import (
+    BooleanField, Exists, F, OuterRef, Prefetch, Subquery, Value)
 from django.contrib.auth import get_user_model
-from django.http import FileResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, reverse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from rest_framework import filters, viewsets, permissions, status
+from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from .filters import RecipeFilter
-from .renderers import render_shopping_list
+from .conditional import (
+    ConditionalMixin, conditional_response, make_etag, normalize_params)
+from .feed import FEED_ORDERING, get_feed
+from .filters import IngredientFilter, RecipeFilter
+from .ingredient_index import ingredient_index
+from .metrics import SHOPPING_LIST_SIZE, measure_stream
+from .paginations import CursorPaginationMixin, FoodgramCursorPagination
+from .renderers import (
+    SHOPPING_LIST_RENDERERS, ShoppingListContentNegotiation)
 from .permissions import IsAuthorOrReadOnly
+from .profiling import section
+from .recipe_cache import recipe_cache
 from .serializers import (
     FoodgramUserSerializer, RecipeSerializer, RecipeResponseSerializer,
-    IngredientSerializer, UserAvatarSerializer,
+    IngredientSerializer, RecipesLimitSerializer, UserAvatarSerializer,
     UserRecipesSerializer)
+from .short_links import recipe_exists
 from recipes.models import (
     FavoriteRecipe, Recipe, RecipeIngredient,
     ShoppingCart, Ingredient, Subscription)
@@ -23,25 +38,68 @@ from recipes.models import (
 User = get_user_model()
 
 
+def get_ingredients_etag(request, snapshot, pk=None):
+    return make_etag(
+        'ingredients', snapshot[2], normalize_params(request), pk)
+
+
+def get_indexed_ingredients(request, snapshot):
+    """Продукты из индекса в памяти, название которых начинается с ?name."""
+    name = request.GET.get('name')
+    return HttpResponse(
+        ingredient_index.search(
+            name or '',
+            settings.INGREDIENT_SEARCH_LIMIT if name else None,
+            snapshot,
+        ),
+        content_type='application/json',
+    )
+
+
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
     pagination_class = None
-    filter_backend = (filters.SearchFilter,)
-    search_fields = ('^name',)
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = IngredientFilter
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        name = self.request.query_params.get('name', None)
-        if name:
-            queryset = queryset.filter(name__istartswith=name)
-        return queryset
+    def get_etag(self, snapshot):
+        return get_ingredients_etag(
+            self.request, snapshot, self.kwargs.get(self.lookup_field))
+
+    def list(self, request, *args, **kwargs):
+        snapshot = ingredient_index.get_snapshot()
+        return conditional_response(
+            request,
+            partial(self.search, snapshot),
+            self.get_etag(snapshot),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_response(
+            request,
+            partial(super().retrieve, request, *args, **kwargs),
+            self.get_etag(ingredient_index.get_snapshot()),
+        )
+
+    def search(self, snapshot):
+        request = self.request
+        if request.query_params.get('search'):
+            ingredients = self.filter_queryset(
+                self.get_queryset())[:settings.INGREDIENT_SEARCH_LIMIT]
+            return Response(self.get_serializer(ingredients, many=True).data)
+        return get_indexed_ingredients(request, snapshot)
 
 
-class FoodgramUserViewSet(UserViewSet):
+class FoodgramUserViewSet(
+        ConditionalMixin, CursorPaginationMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = FoodgramUserSerializer
+    cursor_ordering = ('username',)
+
+    def get_etag_parts(self, user):
+        return user.pk, user.version
 
     @action(detail=False, methods=('get',), url_path='me',
             permission_classes=(permissions.IsAuthenticated,))
@@ -61,21 +119,49 @@ class FoodgramUserViewSet(UserViewSet):
             return Response(
                 serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         elif request.method == 'DELETE':
-            user.avatar.delete(save=True)
+            # Файл может быть общим с другими загрузками, его удалит
+            # collect_media, когда на него перестанут ссылаться.
             user.avatar = None
-            user.save()
+            user.save(update_fields=('avatar',))
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def get_recipes_limit(request):
+        serializer = RecipesLimitSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data.get('recipes_limit')
+
+    @staticmethod
+    def get_subscribed_authors(user, recipes_limit=None):
+        recipes = Recipe.objects.all()
+        if recipes_limit is not None:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects
+                .filter(author=OuterRef('author'))
+                .values('pk')[:recipes_limit]
+            ))
+        return (
+            User.objects
+            .filter(authors__user=user)
+            .annotate(
+                is_subscribed=Value(True, output_field=BooleanField()))
+            .prefetch_related(Prefetch(
+                'recipes', queryset=recipes, to_attr='recipes_preview'))
+            .order_by(*User._meta.ordering)
+        )
+
     @action(detail=False, methods=('get',), url_path='subscriptions',
             permission_classes=(permissions.IsAuthenticated,))
     def subscriptions(self, request):
-        subscriptions = User.objects.filter(authors__user=request.user)
+        subscriptions = self.get_subscribed_authors(
+            request.user, self.get_recipes_limit(request))
         paginated_subscriptions = self.paginate_queryset(subscriptions)
-        serializer = UserRecipesSerializer(
-            paginated_subscriptions, many=True,
-            context={'request': request}
-        )
-        return self.get_paginated_response(serializer.data)
+        with section('serialize'):
+            data = UserRecipesSerializer(
+                paginated_subscriptions, many=True,
+                context={'request': request}
+            ).data
+        return self.get_paginated_response(data)
 
     @action(detail=True, methods=('post', 'delete'), url_path='subscribe')
     def subscribe(self, request, id=None):
@@ -83,20 +169,25 @@ class FoodgramUserViewSet(UserViewSet):
         author = get_object_or_404(User, id=id)
         subscription = Subscription.objects.filter(user=user, author=author)
         if request.method == 'POST':
+            recipes_limit = self.get_recipes_limit(request)
             if user == author:
                 raise ValidationError('Вы не можете подписаться сами на себя')
             if subscription.exists():
                 raise ValidationError('Вы уже подписаны на этого пользователя')
             Subscription.objects.create(user=user, author=author)
             serializer = UserRecipesSerializer(
-                author, context={'request': request})
+                self.get_subscribed_authors(user, recipes_limit).get(
+                    pk=author.pk),
+                context={'request': request}
+            )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         elif request.method == "DELETE":
             get_object_or_404(Subscription, user=user, author=author).delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+        ConditionalMixin, CursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (
@@ -104,12 +195,84 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    @property
+    def cursor_ordering(self):
+        if self.action == 'feed':
+            return FEED_ORDERING
+        if self.request.query_params.get('ordering') == 'popular':
+            # Курсор по популярности приблизительный: позиция берётся по
+            # первому полю, а популярность меняется между запросами
+            # страниц, так что рецепт может повториться или пропасть.
+            # id упорядочивает рецепты с равной популярностью.
+            return ('-popularity', '-id')
+        return FoodgramCursorPagination.ordering
+
+    def get_queryset(self):
+        if self.action == 'destroy':
+            # Для удаления рецепт не сериализуется.
+            return super().get_queryset()
+        user = self.request.user
+        recipes = (
+            super().get_queryset()
+            .select_related('author')
+            .prefetch_related(Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ))
+        )
+        if self.action == 'feed':
+            recipes = get_feed(user, recipes)
+        if not user.is_authenticated:
+            false = Value(False, output_field=BooleanField())
+            return recipes.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                is_author_subscribed=false,
+            )
+        return recipes.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_author_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('author'))),
+        )
+
+    def get_etag_base(self):
+        # Продукты рецепта выводятся с названиями из каталога.
+        return (*super().get_etag_base(), ingredient_index.get_digest())
+
+    def get_etag_parts(self, recipe):
+        return (*super().get_etag_parts(recipe), recipe.author.version)
+
+    def get_last_modified(self, recipe):
+        return max(recipe.updated_at, recipe.author.profile_updated_at)
+
+    def list(self, request, *args, **kwargs):
+        get_response = partial(super().list, request, *args, **kwargs)
+        if recipe_cache.is_cacheable(request):
+            return recipe_cache.respond(request, get_response)
+        return get_response()
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs.get(self.lookup_field)
+        get_response = partial(super().retrieve, request, *args, **kwargs)
+        if recipe_cache.is_cacheable(request, pk):
+            return recipe_cache.respond(request, get_response, pk=pk)
+        return get_response()
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(detail=False, methods=('get',), url_path='feed',
+            permission_classes=(permissions.IsAuthenticated,))
+    def feed(self, request):
+        return self.list(request)
+
     @action(detail=True, methods=('get',), url_path='get-link')
     def get_link(self, request, pk=None):
-        get_object_or_404(Recipe, pk=pk)
+        if not pk.isdigit() or not recipe_exists(int(pk)):
+            raise Http404('Рецепт не найден')
         return Response({
             'short-link': request.build_absolute_uri(
                 reverse('recipes:get_recipe', args=(pk,))
@@ -121,16 +284,19 @@ class RecipeViewSet(viewsets.ModelViewSet):
         recipe = get_object_or_404(Recipe, pk=pk)
         user = request.user
         if request.method == 'POST':
-            relation, created = model_class.objects.get_or_create(
-                user=user, recipe=recipe)
-            if not created:
-                raise ValidationError('Вы уже добавили этот рецепт')
+            with transaction.atomic():
+                relation, created = model_class.objects.get_or_create(
+                    user=user, recipe=recipe)
+                if not created:
+                    raise ValidationError('Вы уже добавили этот рецепт')
             return Response(
                 RecipeResponseSerializer(recipe).data,
                 status=status.HTTP_201_CREATED
             )
         elif request.method == 'DELETE':
-            get_object_or_404(model_class, user=user, recipe=recipe).delete()
+            with transaction.atomic():
+                get_object_or_404(
+                    model_class, user=user, recipe=recipe).delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=('post', 'delete'), url_path='favorite',
@@ -144,24 +310,41 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.handle_recipe(ShoppingCart, request, pk)
 
     @action(detail=False, methods=('get',), url_path='download_shopping_cart',
-            permission_classes=(permissions.IsAuthenticated,))
+            permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=SHOPPING_LIST_RENDERERS,
+            content_negotiation_class=ShoppingListContentNegotiation)
     def download_shopping_cart(self, request):
         user = request.user
         ingredients = (
-            RecipeIngredient.objects
-            .filter(recipe__in=user.shoppingcarts.values('recipe'))
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(amount_total=Sum('amount'))
+            user.shopping_cart_ingredients
+            .values(
+                'ingredient__name', 'ingredient__measurement_unit',
+                amount_total=F('amount'))
             .order_by('ingredient__name')
+            .iterator()
         )
-        print(ingredients)
         recipes = (
             Recipe.objects
             .filter(shoppingcarts__user=user)
+            .values_list('name', flat=True)
+            .iterator()
         )
-        return FileResponse(
-            render_shopping_list(ingredients, recipes, user),
-            as_attachment=True,
-            filename='Shopping_list.txt',
-            content_type='text/plain',
+        if settings.ASYNC_VIEWS:
+            # Под ASGI Django 3.2 читает потоковый ответ в цикле событий,
+            # где запросы к базе запрещены, поэтому данные выбираются
+            # до ответа.
+            ingredients, recipes = list(ingredients), list(recipes)
+        renderer = request.accepted_renderer
+        content = measure_stream(
+            renderer.stream(ingredients, recipes, user),
+            SHOPPING_LIST_SIZE.labels(renderer.format),
         )
+        if renderer.streaming:
+            response = StreamingHttpResponse(
+                content, content_type=renderer.content_type)
+        else:
+            response = HttpResponse(
+                b''.join(content), content_type=renderer.content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="Shopping_list.{renderer.format}"')
+        return response
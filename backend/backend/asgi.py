@@ -12,5 +12,10 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+os.environ.setdefault('SERVER_MODE', 'asgi')
 
 application = get_asgi_application()
+
+from api.ingredient_index import ingredient_index  # noqa: E402
+
+ingredient_index.warm()
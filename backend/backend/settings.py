@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 
 import os
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
@@ -47,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.profiling.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,6 +62,30 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'backend.urls'
 
+TEST_RUNNER = 'api.test_runner.ProfilingTestRunner'
+
+# Метрики Prometheus по адресу /metrics, см. api.metrics. Адрес отвечает
+# только на запросы из сетей METRICS_ALLOWED_NETWORKS.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_ALLOWED_NETWORKS = os.getenv(
+    'METRICS_ALLOWED_NETWORKS',
+    '127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16',
+).split(',')
+
+# Профилирование запросов к базе: заголовок Server-Timing и лог
+# api.profiling. Запрос, превысивший QUERY_BUDGET запросов или
+# повторивший один запрос больше QUERY_DUPLICATES_LIMIT раз, пишется
+# с уровнем WARNING, а при QUERY_BUDGET_RAISE завершается ошибкой.
+QUERY_PROFILING = os.getenv('QUERY_PROFILING', 'false').lower() == 'true'
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 30))
+QUERY_DUPLICATES_LIMIT = int(os.getenv('QUERY_DUPLICATES_LIMIT', 3))
+QUERY_BUDGET_RAISE = False
+
+# wsgi или asgi; при asgi частые запросы на чтение обслуживают
+# асинхронные представления из api.async_views.
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+ASYNC_VIEWS = SERVER_MODE == 'asgi'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -96,6 +124,32 @@ DATABASES = {
 #     }
 # }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'recipes': {
+        'BACKEND': os.getenv(
+            'RECIPES_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('RECIPES_CACHE_LOCATION', 'recipes'),
+        'TIMEOUT': int(os.getenv('RECIPES_CACHE_TIMEOUT', 300)),
+    },
+    # Список отозванных JWT, см. api.authentication. По умолчанию —
+    # memcached из infra/docker-compose.yml; с кэшем в базе
+    # (DatabaseCache, таблица создаётся командой createcachetable) каждый
+    # вход по JWT стоит запроса к базе.
+    'jwt_denylist': {
+        'BACKEND': os.getenv(
+            'JWT_DENYLIST_CACHE_BACKEND',
+            'django.core.cache.backends.memcached.PyMemcacheCache'
+        ),
+        'LOCATION': os.getenv(
+            'JWT_DENYLIST_CACHE_LOCATION', 'memcached:11211'),
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -142,19 +196,38 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'recipes.FoodgramUser'
 
+# token — токены в базе (auth/token/), jwt — дополнительно JWT
+# (auth/jwt/), которые проверяются без обращения к базе, см.
+# api.authentication.
+AUTH_MODE = os.getenv('AUTH_MODE', 'token')
+
+AUTHENTICATION_CLASSES = ['api.authentication.TokenAuthentication']
+if AUTH_MODE == 'jwt':
+    AUTHENTICATION_CLASSES.insert(0, 'api.authentication.JWTAuthentication')
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 
-    'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': AUTHENTICATION_CLASSES,
 
     'DEFAULT_PAGINATION_CLASS': 'api.paginations.FoodgramPagination',
     'PAGE_SIZE': 6,
 }
 
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(
+        minutes=int(os.getenv('JWT_ACCESS_TOKEN_MINUTES', 5))),
+    'REFRESH_TOKEN_LIFETIME': timedelta(
+        days=int(os.getenv('JWT_REFRESH_TOKEN_DAYS', 7))),
+    'ROTATE_REFRESH_TOKENS': True,
+    'AUTH_HEADER_TYPES': ('Bearer',),
+}
+# Кэш списка отозванных JWT. Он должен быть общим для всех процессов
+# сервера: кэш в памяти процесса при AUTH_MODE=jwt не даёт запуститься.
+JWT_DENYLIST_CACHE = os.getenv('JWT_DENYLIST_CACHE', 'jwt_denylist')
+
 DJOSER = {
     'SERIALIZERS': {
         'user': 'api.serializers.FoodgramUserSerializer',
@@ -170,3 +243,52 @@ DJOSER = {
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+DEFAULT_FILE_STORAGE = 'recipes.storage.ContentAddressedStorage'
+
+# Число процессов для построения копий изображений; 0 — строить их
+# синхронно, сразу после сохранения.
+IMAGE_PIPELINE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', 2))
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 100))
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+# За сколько дней вклад добавления в избранное или корзину в популярность
+# рецепта уменьшается вдвое.
+POPULARITY_HALF_LIFE_DAYS = float(os.getenv('POPULARITY_HALF_LIFE_DAYS', 7))
+
+# Рецепты авторов с большим числом подписчиков не раскладываются по
+# лентам при публикации, а добираются при чтении ленты.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 10000))
+FEED_FANOUT_BATCH_SIZE = int(os.getenv('FEED_FANOUT_BATCH_SIZE', 1000))
+# Число потоков для раскладки рецептов по лентам; 0 — раскладывать
+# синхронно, сразу после фиксации транзакции.
+FEED_FANOUT_WORKERS = int(os.getenv('FEED_FANOUT_WORKERS', 2))
+
+# Кэш токенов авторизации, см. api.authentication. TOKEN_CACHE_SIZE=0
+# отключает кэш в памяти процесса, TOKEN_CACHE_ALIAS — алиас из CACHES
+# для общего между процессами кэша.
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 30))
+TOKEN_CACHE_ALIAS = os.getenv('TOKEN_CACHE_ALIAS') or None
+TOKEN_SHARED_CACHE_TIMEOUT = int(
+    os.getenv('TOKEN_SHARED_CACHE_TIMEOUT', 300))
+
+# Длина подписи кода короткой ссылки; 0 — коды без подписи. При подписи
+# старые ссылки /s/<id>/ работают, только если SHORT_LINK_LEGACY_IDS=True.
+SHORT_LINK_SIGNATURE_LENGTH = int(os.getenv('SHORT_LINK_SIGNATURE_LENGTH', 0))
+SHORT_LINK_LEGACY_IDS = (
+    os.getenv('SHORT_LINK_LEGACY_IDS', 'False').lower() == 'true')
+# Существование рецептов для коротких ссылок кэшируется в кэше
+# SHORT_LINK_CACHE_ALIAS. Удаление рецепта сбрасывает запись только в этом
+# кэше, поэтому с кэшем в памяти процесса (по умолчанию) остальные
+# процессы узнают об удалении через SHORT_LINK_CACHE_TIMEOUT секунд; для
+# общего кэша срок можно увеличить.
+SHORT_LINK_CACHE_ALIAS = os.getenv('SHORT_LINK_CACHE_ALIAS', 'default')
+SHORT_LINK_CACHE_TIMEOUT = int(os.getenv('SHORT_LINK_CACHE_TIMEOUT', 60))
+SHORT_LINK_MISS_CACHE_TIMEOUT = int(
+    os.getenv('SHORT_LINK_MISS_CACHE_TIMEOUT', 5))
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
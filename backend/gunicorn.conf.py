@@ -0,0 +1,36 @@
+"""Настройки gunicorn: SERVER_MODE=asgi запускает воркеры uvicorn."""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+    wsgi_app = 'backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    default_workers = multiprocessing.cpu_count()
+else:
+    wsgi_app = 'backend.wsgi:application'
+    default_workers = multiprocessing.cpu_count() * 2 + 1
+
+workers = int(os.getenv('WEB_CONCURRENCY', default_workers))
+
+# Метрики Prometheus собираются со всех воркеров через файлы в этом
+# каталоге, см. api.metrics.
+os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'foodgram-metrics'),
+)
+
+
+def on_starting(server):
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
+from django.core.files.storage import default_storage
 from django.utils.safestring import mark_safe
 
 from .admin_filters import CookingTimeFilter
@@ -11,6 +12,11 @@ from .models import (
 User = get_user_model()
 
 
+def get_thumbnail_url(image, variants):
+    name = variants.get('thumb', {}).get('jpeg')
+    return default_storage.url(name) if name else image.url
+
+
 class GetRecipesMixin:
     @admin.display(description='Рецепты')
     def get_recipes(self, model):
@@ -37,7 +43,7 @@ class RecipeAdmin(admin.ModelAdmin):
         'name',
         'cooking_time',
         'author',
-        'get_in_favorites',
+        'favorites_count',
         'get_ingredients',
         'get_image',
     )
@@ -45,10 +51,6 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', CookingTimeFilter)
     inlines = (RecipeIngredientInline,)
 
-    @admin.display(description='В избранном')
-    def get_in_favorites(self, recipe):
-        return recipe.favoriterecipes.count()
-
     @admin.display(description='Продукты')
     @mark_safe
     def get_ingredients(self, recipe):
@@ -61,20 +63,21 @@ class RecipeAdmin(admin.ModelAdmin):
     @admin.display(description='Изображение')
     @mark_safe
     def get_image(self, recipe):
-        return f'<img src="{recipe.image.url}" style="height: 100px;" />'
+        url = get_thumbnail_url(recipe.image, recipe.image_variants)
+        return f'<img src="{url}" style="height: 100px;" />'
 
 
 @admin.register(User)
-class FoodgramUserAdmin(UserAdmin, GetRecipesMixin):
+class FoodgramUserAdmin(UserAdmin):
     list_display = (
         'id',
         'username',
         'full_name',
         'email',
         'get_avatar',
-        'get_recipes',
-        'get_subscriptions',
-        'get_subscribers',
+        'recipes_count',
+        'subscriptions_count',
+        'subscribers_count',
     )
 
     @admin.display(description='ФИО')
@@ -85,18 +88,11 @@ class FoodgramUserAdmin(UserAdmin, GetRecipesMixin):
     @mark_safe
     def get_avatar(self, user):
         if user.avatar:
-            return (f'<img src="{user.avatar_url}" '
+            url = get_thumbnail_url(user.avatar, user.avatar_variants)
+            return (f'<img src="{url}" '
                     'style="width:50 px;border-radius:50%;" />')
         return 'Нет аватара'
 
-    @admin.display(description='Подписки')
-    def get_subscriptions(self, user):
-        return user.subscribers.count()
-
-    @admin.display(description='Подписчики')
-    def get_subscribers(self, user):
-        return user.authors.count()
-
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
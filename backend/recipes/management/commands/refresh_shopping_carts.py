@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает суммы продуктов в корзинах покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить суммы с рецептами, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            return self.check_totals()
+        totals = ShoppingCartIngredient.objects.refresh()
+        self.stdout.write(self.style.SUCCESS(
+            f'Суммы в корзинах пересобраны. Записей: {len(totals)}'
+        ))
+
+    def check_totals(self):
+        stored = {
+            (total['user'], total['ingredient']): total['amount']
+            for total in ShoppingCartIngredient.objects.values(
+                'user', 'ingredient', 'amount').iterator()
+        }
+        mismatches = 0
+        for total in ShoppingCartIngredient.objects.calculate().iterator():
+            key = (total['user'], total['ingredient'])
+            amount = stored.pop(key, None)
+            if amount != total['total']:
+                mismatches += 1
+                self.stderr.write(
+                    f'Пользователь {key[0]}, продукт {key[1]}: '
+                    f'сохранено {amount}, должно быть {total["total"]}'
+                )
+        for (user, ingredient), amount in stored.items():
+            mismatches += 1
+            self.stderr.write(
+                f'Пользователь {user}, продукт {ingredient}: '
+                f'сохранено {amount}, должно быть None'
+            )
+        if mismatches:
+            raise CommandError(f'Найдено расхождений: {mismatches}')
+        self.stdout.write(self.style.SUCCESS('Расхождений не найдено'))
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.16 on 2026-10-18 17:21
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_shoppingcartingredient'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='ingredient_name_trgm', opclasses=('gin_trgm_ops',)),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='recipe_name_trgm', opclasses=('gin_trgm_ops',)),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.16 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+def fill_updated_at(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Версия данных'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+    ]
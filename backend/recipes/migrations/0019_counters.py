@@ -0,0 +1,66 @@
+# Generated by Django 3.2.16 on 2026-10-18 17:47
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by().values(field)
+        .annotate(count=Count('pk')).values('count')
+    ), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    FoodgramUser = apps.get_model('recipes', 'FoodgramUser')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FavoriteRecipe = apps.get_model('recipes', 'FavoriteRecipe')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    Subscription = apps.get_model('recipes', 'Subscription')
+    Recipe.objects.update(
+        favorites_count=count(FavoriteRecipe, 'recipe'),
+        shopping_carts_count=count(ShoppingCart, 'recipe'),
+    )
+    FoodgramUser.objects.update(
+        recipes_count=count(Recipe, 'author'),
+        subscriptions_count=count(Subscription, 'user'),
+        subscribers_count=count(Subscription, 'author'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецепты'),
+        ),
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчики'),
+        ),
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='subscriptions_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписки'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
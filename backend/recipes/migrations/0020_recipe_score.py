@@ -0,0 +1,83 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:02
+
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# Те же константы, что в api.popularity на момент миграции.
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+WEIGHTS = (('FavoriteRecipe', 1.0), ('ShoppingCart', 2.0))
+ADD_CONTRIBUTIONS_SQL = '''
+    UPDATE {scores} AS score
+    SET score = score.score + contributions.total
+    FROM (
+        SELECT recipe_id, sum(
+            %s * power(2.0, (EXTRACT(EPOCH FROM created_at) - %s) / %s)
+        ) AS total
+        FROM {relations}
+        GROUP BY recipe_id
+    ) AS contributions
+    WHERE score.recipe_id = contributions.recipe_id
+'''
+
+
+def create_scores(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeScore = apps.get_model('recipes', 'RecipeScore')
+    RecipeScore.objects.bulk_create(
+        RecipeScore(recipe_id=pk)
+        for pk in Recipe.objects.values_list('pk', flat=True).iterator()
+    )
+    # Существующее избранное и корзины получили дату добавления в момент
+    # миграции, поэтому популярность пропорциональна их числу.
+    half_life = settings.POPULARITY_HALF_LIFE_DAYS * 24 * 60 * 60
+    for model_name, weight in WEIGHTS:
+        schema_editor.execute(
+            ADD_CONTRIBUTIONS_SQL.format(
+                scores=RecipeScore._meta.db_table,
+                relations=apps.get_model(
+                    'recipes', model_name)._meta.db_table,
+            ),
+            (weight, EPOCH.timestamp(), half_life),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favoriterecipe',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Добавлено'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Добавлено'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('score', models.FloatField(default=0, verbose_name='Популярность')),
+            ],
+            options={
+                'verbose_name': 'популярность рецепта',
+                'verbose_name_plural': 'Популярность рецептов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-score', '-recipe'], name='recipescore_score_idx'),
+        ),
+        migrations.RunPython(create_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.16 on 2026-10-18 17:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_feeds(apps, schema_editor):
+    tables = {
+        name: apps.get_model(app, model)._meta.db_table
+        for name, (app, model) in {
+            'feed': ('recipes', 'FeedEntry'),
+            'subscription': ('recipes', 'Subscription'),
+            'user': settings.AUTH_USER_MODEL.split('.'),
+            'recipe': ('recipes', 'Recipe'),
+        }.items()
+    }
+    schema_editor.execute(
+        '''
+        INSERT INTO {feed} (user_id, recipe_id, created_at)
+        SELECT subscription.user_id, recipe.id, recipe.created_at
+        FROM {subscription} AS subscription
+        JOIN {user} AS author ON author.id = subscription.author_id
+        JOIN {recipe} AS recipe ON recipe.author_id = subscription.author_id
+        WHERE author.subscribers_count <= %s
+        '''.format(**tables),
+        (settings.FEED_FANOUT_LIMIT,),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0020_recipe_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(verbose_name='Дата публикации')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик')),
+            ],
+            options={
+                'verbose_name': 'запись ленты',
+                'verbose_name_plural': 'Записи лент',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-created_at', '-recipe'], name='feedentry_user_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feedentry'),
+        ),
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:47
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0021_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='profile_updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Профиль изменён'),
+        ),
+    ]
@@ -1,14 +1,35 @@
 from django.core.validators import RegexValidator, MinValueValidator
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.db import models, transaction
+from django.utils import timezone
 
 MIN_COOKING_TIME = 1
 MIN_AMOUNT = 1
 
 
+class CountersMixin:
+    """Не перезаписывает при save() поля, которые меняются F-выражениями.
+
+    Иначе сохранение объекта, загруженного раньше параллельного
+    изменения счётчика, вернуло бы счётчику старое значение.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is None and not self._state.adding:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, update_fields=update_fields, **kwargs)
+
+
 # Create your models here.
-class FoodgramUser(AbstractUser):
+class FoodgramUser(CountersMixin, AbstractUser):
     username = models.CharField(
         'Никнейм',
         max_length=150,
@@ -23,6 +44,20 @@ class FoodgramUser(AbstractUser):
         max_length=254,)
     avatar = models.ImageField(
         'Аватарка', blank=True, upload_to='avatar_images')
+    avatar_variants = models.JSONField(
+        'Копии аватарки', default=dict, blank=True, editable=False)
+    version = models.PositiveIntegerField('Версия данных', default=0)
+    profile_updated_at = models.DateTimeField(
+        'Профиль изменён', default=timezone.now, editable=False)
+    recipes_count = models.PositiveIntegerField(
+        'Рецепты', default=0, editable=False)
+    subscriptions_count = models.PositiveIntegerField(
+        'Подписки', default=0, editable=False)
+    subscribers_count = models.PositiveIntegerField(
+        'Подписчики', default=0, editable=False)
+    counter_fields = (
+        'version', 'profile_updated_at', 'recipes_count',
+        'subscriptions_count', 'subscribers_count')
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
 
@@ -45,23 +80,35 @@ class Ingredient(models.Model):
                 name='unique_ingredient'
             ),
         )
+        indexes = (
+            GinIndex(
+                fields=('name',),
+                name='ingredient_name_trgm',
+                opclasses=('gin_trgm_ops',),
+            ),
+        )
         ordering = ('name',)
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(CountersMixin, models.Model):
+    # Индексы внешних ключей, которые начинают составные индексы или
+    # ограничения уникальности модели, не создаются: они лишние.
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
         related_name='recipes',
         verbose_name='Автор',
+        db_index=False,
     )
     name = models.CharField('Название', max_length=150)
     image = models.ImageField(
         'Изображение',
         upload_to='recipe_images'
     )
+    image_variants = models.JSONField(
+        'Копии изображения', default=dict, blank=True, editable=False)
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -74,11 +121,29 @@ class Recipe(models.Model):
         validators=(MinValueValidator(MIN_COOKING_TIME),)
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False)
+    shopping_carts_count = models.PositiveIntegerField(
+        'В корзинах', default=0, editable=False)
+    counter_fields = ('favorites_count', 'shopping_carts_count')
 
     class Meta:
         verbose_name = 'рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-created_at',)
+        indexes = (
+            GinIndex(
+                fields=('name',),
+                name='recipe_name_trgm',
+                opclasses=('gin_trgm_ops',),
+            ),
+            models.Index(fields=('-created_at',), name='recipe_created_idx'),
+            models.Index(
+                fields=('author', '-created_at'),
+                name='recipe_author_created_idx',
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -88,12 +153,14 @@ class Subscription(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
         related_name='subscribers',
-        verbose_name='Подписчик'
+        verbose_name='Подписчик',
+        db_index=False,
     )
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
         related_name='authors',
-        verbose_name='Автор'
+        verbose_name='Автор',
+        db_index=False,
     )
 
     class Meta:
@@ -105,6 +172,12 @@ class Subscription(models.Model):
                 name='unique_subscription'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('author', 'user'),
+                name='subscription_author_user_idx',
+            ),
+        )
 
     def __str__(self):
         return f"{self.user} подписан на {self.author}"
@@ -114,7 +187,8 @@ class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
-        related_name='recipe_ingredients'
+        related_name='recipe_ingredients',
+        db_index=False,
     )
     ingredient = models.ForeignKey(
         Ingredient,
@@ -124,20 +198,32 @@ class RecipeIngredient(models.Model):
     amount = models.PositiveIntegerField(
         validators=(MinValueValidator(MIN_AMOUNT),))
 
+    class Meta:
+        indexes = (
+            models.Index(
+                fields=('recipe',),
+                include=('ingredient', 'amount'),
+                name='recipeingredient_recipe_idx',
+            ),
+        )
+
 
 class UserRecipeRelation(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
-        related_name='%(class)ss'
+        related_name='%(class)ss',
+        db_index=False,
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
         verbose_name='Рецепт',
         related_name='%(class)ss',
+        db_index=False,
     )
+    created_at = models.DateTimeField('Добавлено', auto_now_add=True)
 
     class Meta:
         abstract = True
@@ -147,18 +233,152 @@ class UserRecipeRelation(models.Model):
                 name='unique_%(class)s'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('recipe', 'user'), name='%(class)s_recipe_user_idx'),
+        )
 
     def str(self):
         return f'{self.user} - {self.recipe}'
 
 
 class ShoppingCart(UserRecipeRelation, UserRecipeRelation.Meta):
-    class Meta:
+    class Meta(UserRecipeRelation.Meta):
         verbose_name = 'корзина покупок'
         verbose_name_plural = 'Корзины покупок'
 
 
 class FavoriteRecipe(UserRecipeRelation, UserRecipeRelation.Meta):
-    class Meta:
+    class Meta(UserRecipeRelation.Meta):
         verbose_name = 'избранный рецепт'
         verbose_name_plural = 'Избранные рецепты'
+
+
+class RecipeScore(models.Model):
+    """Популярность рецепта для сортировки ?ordering=popular."""
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт',
+    )
+    score = models.FloatField('Популярность', default=0)
+
+    class Meta:
+        verbose_name = 'популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+        indexes = (
+            models.Index(
+                fields=('-score', '-recipe'), name='recipescore_score_idx'),
+        )
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика автора."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+    )
+    # Копия даты публикации рецепта, чтобы страница ленты читалась
+    # одним проходом по индексу.
+    created_at = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'Записи лент'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'), name='unique_feedentry'),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-created_at', '-recipe'),
+                name='feedentry_user_created_idx',
+            ),
+        )
+
+
+class ShoppingCartIngredientManager(models.Manager):
+    def calculate(self, users=None, ingredients=None):
+        """Суммы продуктов в корзинах, посчитанные по рецептам."""
+        amounts = RecipeIngredient.objects.filter(
+            recipe__shoppingcarts__isnull=False)
+        if users is not None:
+            amounts = amounts.filter(recipe__shoppingcarts__user__in=users)
+        if ingredients is not None:
+            amounts = amounts.filter(ingredient__in=ingredients)
+        return (
+            amounts
+            .values('ingredient', user=models.F('recipe__shoppingcarts__user'))
+            .annotate(total=models.Sum('amount'))
+            .order_by()
+        )
+
+    def refresh(self, users=None, ingredients=None):
+        """Пересчитывает суммы для указанных пользователей и продуктов.
+
+        Без аргументов пересобирает всю таблицу.
+        """
+        stale = self.all()
+        with transaction.atomic():
+            if users is not None:
+                users = list(
+                    FoodgramUser.objects.select_for_update()
+                    .filter(pk__in=users).order_by('pk')
+                    .values_list('pk', flat=True)
+                )
+                stale = stale.filter(user__in=users)
+            if ingredients is not None:
+                ingredients = set(ingredients)
+                stale = stale.filter(ingredient__in=ingredients)
+            stale.delete()
+            return self.bulk_create(
+                self.model(
+                    user_id=total['user'],
+                    ingredient_id=total['ingredient'],
+                    amount=total['total'],
+                )
+                for total in self.calculate(users, ingredients).iterator()
+            )
+
+
+class ShoppingCartIngredient(models.Model):
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_cart_ingredients',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Продукт',
+        related_name='shopping_cart_ingredients',
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = 'продукт в корзине'
+        verbose_name_plural = 'Продукты в корзинах'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_cart_ingredient'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient} {self.amount}'
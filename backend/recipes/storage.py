@@ -0,0 +1,44 @@
+import os
+from hashlib import sha256
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором файл называется по sha256 содержимого.
+
+    Одинаковые загрузки хранятся одним файлом, а существующие файлы
+    никогда не перезаписываются, поэтому их можно кэшировать бессрочно.
+    Файлы, на которые больше никто не ссылается, удаляет команда
+    collect_media.
+    """
+
+    def get_content_name(self, name, content):
+        digest = sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = digest.hexdigest()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            # Свежая дата изменения защищает файл от collect_media, пока
+            # ссылка на него ещё не сохранена в базе.
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # collect_media удалил файл после проверки, пишем заново.
+                pass
+        return super().save(name, content, max_length)
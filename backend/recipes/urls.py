@@ -1,9 +1,17 @@
-from django.urls import path
+from django.conf import settings
+from django.urls import path, register_converter
 
-from .views import get_recipe
+from api.short_links import ShortCodeConverter
+from .views import get_recipe, get_recipe_async
 
 app_name = 'recipes'
 
+register_converter(ShortCodeConverter, 'short_code')
+
 urlpatterns = [
-    path('s/<int:recipe_id>/', get_recipe, name='get_recipe'),
+    path(
+        's/<short_code:recipe_id>/',
+        get_recipe_async if settings.ASYNC_VIEWS else get_recipe,
+        name='get_recipe',
+    ),
 ]
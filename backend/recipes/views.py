@@ -1,8 +1,25 @@
-from django.shortcuts import get_object_or_404, redirect
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from django.shortcuts import redirect
 
-from .models import Recipe
+from api.short_links import (
+    get_cached_existence, load_existence, recipe_exists)
 
 
-def get_recipe(request, recipe_id):
-    get_object_or_404(Recipe, pk=recipe_id)
+def get_redirect(recipe_id, exists):
+    if not exists:
+        raise Http404('Рецепт не найден')
     return redirect(f'/recipes/{recipe_id}')
+
+
+def get_recipe(request, recipe_id):
+    return get_redirect(recipe_id, recipe_exists(recipe_id))
+
+
+async def get_recipe_async(request, recipe_id):
+    # В Django 3.2 у кэша нет асинхронного API.
+    exists = await sync_to_async(
+        get_cached_existence, thread_sensitive=False)(recipe_id)
+    if exists is None:
+        exists = await sync_to_async(load_existence)(recipe_id)
+    return get_redirect(recipe_id, exists)